@@ -1,28 +1,46 @@
 import os
-from flask import Flask, send_from_directory
-from urllib.parse import quote as urlquote
+from flask import Flask, send_from_directory, request, abort
 
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State, ALL, MATCH
+from dash.dependencies import Input, Output, State, ALL, MATCH,            \
+                             ClientsideFunction
 import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
 from plotutils import *
 from sfsutils import parse_savefile
 from iniutils import ini_to_system
 from imageutils import map_url
+from sessionstore import SessionStore, FileBackend
+from jobs import JobQueue
 from base64 import b64decode
+from dash.exceptions import PreventUpdate
 from collections import OrderedDict
 
 import jsonpickle
+import hashlib
+import threading
+import tempfile
 import math
 import numpy as np
 from orbit import Orbit
 from body import Body
-from craft import Craft
+from craft import Craft, get_craft_from_spec, propagate_crafts,            \
+    init_propagation_worker
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 
 DOWNLOAD_DIRECTORY = "/tmp/app_generated_files"
 
+# exported figures load this copy of plotly.js from the app, instead of each
+# embedding it or loading it from a CDN
+PLOTLYJS_FILENAME = 'plotly.min.js'
+
+# number of exported HTML files kept in the download directory
+EXPORT_CACHE_SIZE = int(os.environ.get('EXPORT_CACHE_SIZE', 64))
+
 if not os.path.exists(DOWNLOAD_DIRECTORY):
     os.makedirs(DOWNLOAD_DIRECTORY)
 
@@ -34,16 +52,161 @@ app = dash.Dash(__name__, # external_stylesheets=external_stylesheets,
 
 app.title='KSP Trajectory Illustrator'
 
+#%% server-side storage of systems, orbits, and crafts
+# The hidden divs only hold keys to objects in the session store. Setting
+# SESSION_STORE_DIRECTORY shares the stored objects between worker processes
+# through files; REDIS_URL does the same through a Redis server. Shared
+# objects expire after SESSION_STORE_TTL seconds.
+SESSION_STORE_TTL = int(os.environ.get('SESSION_STORE_TTL', 24*3600))
+if os.environ.get('REDIS_URL'):
+    import redis
+    session_backend = redis.from_url(os.environ['REDIS_URL'])
+elif os.environ.get('SESSION_STORE_DIRECTORY'):
+    session_backend = FileBackend(
+        os.environ['SESSION_STORE_DIRECTORY'], SESSION_STORE_TTL,
+        int(os.environ.get('SESSION_STORE_BYTES', 2**30)))
+else:
+    session_backend = None
+session_store = SessionStore(
+    int(os.environ.get('SESSION_STORE_SIZE', 256)), session_backend,
+    SESSION_STORE_TTL)
+
+def get_figure_key(**renderInputs):
+    """Returns a session store key for figure layers drawn with the given
+    inputs."""
+    figureId = repr(sorted(renderInputs.items()))
+    return 'figure-' + hashlib.sha1(figureId.encode('utf-8')).hexdigest()
+
+def combine_figure_layers(staticLayers, dynamicLayers, t = None):
+    """Returns a figure (as a dictionary) with the static layers followed by
+    the dynamic layers, with the surface rotated and the dynamic layers
+    moved to time t (by default, the time they were drawn for). The browser
+    does the same in assets/figures.js."""
+    
+    if t is None:
+        t = dynamicLayers['time']
+    
+    data = list(staticLayers['figure']['data'])
+    surfaceIdx = staticLayers['surfaceIdx']
+    if not surfaceIdx is None:
+        rotation = staticLayers['rotationRate'] *                           \
+                   (t - staticLayers['refTime'])
+        data[surfaceIdx] = rotate_surface_trace(data[surfaceIdx], rotation)
+    dynamicData = [move_trace(trace, motion, t) for trace, motion in        \
+                   zip(dynamicLayers['data'], dynamicLayers['motions'])]
+    return dict(data = data + dynamicData,
+                layout = staticLayers['figure']['layout'])
+
+def get_stored(key):
+    """Returns an object from the session store, or skips the callback if
+    it has expired."""
+    try:
+        return session_store.get(key)
+    except KeyError:
+        raise PreventUpdate
+
+# Systems, the sources they are decoded from, and uploaded systems are kept
+# in their own store, so that they aren't evicted by the many orbit and
+# figure entries of the session store.
+system_store = SessionStore(
+    int(os.environ.get('SYSTEM_STORE_SIZE', 64)), session_backend,
+    SESSION_STORE_TTL)
+
+# long calculations run as queued background jobs, with results in the store
+job_queue = JobQueue(session_store, int(os.environ.get('JOB_WORKERS', 2)),
+                     int(os.environ.get('JOB_MAX_AGE', 600)))
+
 #%% read solar system data
-infile = open('kerbol_system.json','r')
-kerbol_system = jsonpickle.decode(infile.read())
-infile.close()
-infile = open('outer_planets_system.json','r')
-outer_planets_system = jsonpickle.decode(infile.read())
-infile.close()
-infile = open('sol_system.json','r')
-sol_system = jsonpickle.decode(infile.read())
-infile.close()
+# presets are kept encoded, so each selected system is a fresh copy that
+# can be resized and rescaled
+for systemName, systemFile in [('stock', 'kerbol_system.json'),
+                               ('opm', 'outer_planets_system.json'),
+                               ('rss', 'sol_system.json')]:
+    infile = open(systemFile,'r')
+    system_store.pin(systemName+'-encoded', infile.read())
+    infile.close()
+kerbol_system = jsonpickle.decode(system_store.get('stock-encoded'))
+for body in kerbol_system:
+    body.freeze()
+system_store.pin('stock', kerbol_system)
+system_store.pin('stock-source', ('stock-encoded', 1, 1))
+PRESET_KEYS = ['stock-encoded', 'opm-encoded', 'rss-encoded']
+
+# crafts are propagated in parallel worker processes. Workers are spawned
+# rather than forked from this threaded process, and decode the systems
+# themselves.
+propagation_pool = ProcessPoolExecutor(
+    int(os.environ.get('PROPAGATION_WORKERS', os.cpu_count() or 1)),
+    mp_context = multiprocessing.get_context('spawn'),
+    initializer = init_propagation_worker,
+    initargs = ({key: system_store.get(key) for key in PRESET_KEYS},))
+
+def make_system(key, encodedKey, resizeFactor, rescaleFactor):
+    """Decodes, resizes, and rescales a system, and stores it under the key.
+    
+    Raises:
+        KeyError: if the encoded system isn't stored anymore
+    """
+    
+    system = jsonpickle.decode(system_store.get(encodedKey))
+    for body in system:
+        body.resize(resizeFactor)
+        body.rescale(rescaleFactor)
+    for body in system:
+        body.freeze()
+    system_store.put(system, key)
+    return system
+
+def get_system(encodedKey, resizeFactor, rescaleFactor):
+    """Returns the key of a stored system with the given scale factors.
+    
+    The system is only decoded, resized, and rescaled the first time a
+    configuration is requested. Stored systems are shared between sessions,
+    so their bodies are frozen, and modifying them raises an AttributeError.
+    
+    Args:
+        encodedKey (string): key of the encoded preset or uploaded system
+        resizeFactor (float): scale factor for body radii
+        rescaleFactor (float): scale factor for orbit sizes
+    
+    Returns:
+        the key of the decoded and scaled system
+    
+    Raises:
+        KeyError: if the encoded system isn't stored anymore
+    """
+    
+    systemId = repr((encodedKey, resizeFactor, rescaleFactor))
+    key = 'system-' + hashlib.sha1(systemId.encode('utf-8')).hexdigest()
+    system_store.put((encodedKey, resizeFactor, rescaleFactor),
+                     key + '-source')
+    if not key in system_store:
+        make_system(key, encodedKey, resizeFactor, rescaleFactor)
+    return key
+
+def load_system(key):
+    """Returns a stored system, decoding it again from its source if it has
+    been evicted.
+    
+    Raises:
+        KeyError: if neither the system nor its source is stored anymore
+    """
+    
+    try:
+        return system_store.get(key)
+    except KeyError:
+        return make_system(key, *system_store.get(key + '-source'))
+
+def get_stored_system(key):
+    """Returns a stored system, or skips the callback if it's gone."""
+    try:
+        return load_system(key)
+    except KeyError:
+        raise PreventUpdate
+
+# shown when the selected system has to be selected or uploaded again
+SYSTEM_LOST_MESSAGE = 'The selected system is no longer available. ' +      \
+                      'Please select or upload it again.'
 
 #%%
 
@@ -69,20 +232,28 @@ def range_in_range(start1, end1, start2, end2):
     else:
         return False
 
-def add_maneuver_node(nodesList, num, burn=None):
+def add_maneuver_node(nodesList, num, index, burn=None):
     if burn is None:
         burn = [None, None, None, None]
     nodesList.append(html.Label('Maneuver node '+str(num)))
-    nodesList.append(dcc.Input(type='number',
+    nodesList.append(dcc.Input(id={'type': 'prograde-input',
+                                   'index': index, 'node': num},
+                               type='number',
                                placeholder='Prograde (m/s)',
                                value=burn[0]))
-    nodesList.append(dcc.Input(type='number',
+    nodesList.append(dcc.Input(id={'type': 'normal-input',
+                                   'index': index, 'node': num},
+                               type='number',
                                placeholder='Normal (m/s)',
                                value=burn[1]))
-    nodesList.append(dcc.Input(type='number',
+    nodesList.append(dcc.Input(id={'type': 'radial-input',
+                                   'index': index, 'node': num},
+                               type='number',
                                placeholder='Radial (m/s)',
                                value=burn[2]))
-    nodesList.append(dcc.Input(type='number',
+    nodesList.append(dcc.Input(id={'type': 'nodeTime-input',
+                                   'index': index, 'node': num},
+                               type='number',
                                placeholder='UT (s)',
                                value=burn[3]))
 
@@ -205,7 +376,7 @@ def make_new_craft_tab(label, index, system,
                 ])
     
     for ii in range(numNodes):
-        add_maneuver_node(newTab.children[3].children[1].children[3].children, ii+1, maneuverNodes[ii])
+        add_maneuver_node(newTab.children[3].children[1].children[3].children, ii+1, index, maneuverNodes[ii])
     
     return newTab
 
@@ -265,6 +436,19 @@ def make_new_graphs_tab(sys, idx, sliderStartTime, sliderEndTime):
                                 'index': idx},
                             children = [False]
                             ),
+                        dcc.Store(
+                            id={'type': 'orbitStatic-store',
+                                'index': idx}
+                            ),
+                        dcc.Store(
+                            id={'type': 'orbitDynamic-store',
+                                'index': idx}
+                            ),
+                        html.Div(
+                            id={'type': 'orbitStaticKey-div',
+                                'index': idx},
+                            style={'display': 'none'}
+                            ),
                         html.Div(
                             id={'type': 'tab-surf-rendered',
                                 'index': idx},
@@ -288,9 +472,92 @@ def make_surface_projection_plot(orbitsTimes, startTime, endTime,
     return fig
 #%% download functions
 
+def get_export_figure(key, t = None):
+    """Returns the stored figure to be exported, moved to time t if it's an
+    orbit graph.
+    
+    Raises:
+        KeyError: if the figure isn't in the session store
+    """
+    
+    entry = session_store.get(key)
+    if 'surface' in entry:
+        return get_surface_figure(entry['surface'])
+    staticLayers = session_store.get(entry['key'])
+    return combine_figure_layers(staticLayers, entry, t)
+
+def prune_download_directory(maxFiles):
+    """Removes the least recently written exported files, keeping at most
+    maxFiles of them."""
+    
+    paths = [os.path.join(DOWNLOAD_DIRECTORY, filename)
+             for filename in os.listdir(DOWNLOAD_DIRECTORY)
+             if filename.endswith('.html')]
+    paths.sort(key = os.path.getmtime)
+    for path in paths[:max(len(paths)-maxFiles, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def write_download_file(filename, write):
+    """Writes a file in the download directory through a unique temporary
+    file, so a partly written file is never served.
+    
+    Args:
+        filename (string): name of the file in the download directory
+        write (function): writes the file's contents to a given path
+    """
+    
+    fd, tmpPath = tempfile.mkstemp(suffix = '.tmp', dir = DOWNLOAD_DIRECTORY)
+    os.close(fd)
+    try:
+        write(tmpPath)
+        # mkstemp only lets the owner read the file
+        os.chmod(tmpPath, 0o644)
+        os.replace(tmpPath, os.path.join(DOWNLOAD_DIRECTORY, filename))
+    except Exception:
+        os.remove(tmpPath)
+        raise
+
+def write_plotlyjs(path):
+    with open(path, 'w', encoding='utf-8') as outfile:
+        outfile.write(get_plotlyjs())
+
 @app.server.route('/download/<path:path>')
 def serve_static(path):
-    return send_from_directory(DOWNLOAD_DIRECTORY, path, as_attachment=True)
+    
+    # shared copy of plotly.js used by the exported files
+    if path == PLOTLYJS_FILENAME:
+        plotlyPath = os.path.join(DOWNLOAD_DIRECTORY, PLOTLYJS_FILENAME)
+        if not os.path.exists(plotlyPath):
+            write_download_file(PLOTLYJS_FILENAME, write_plotlyjs)
+        return send_from_directory(DOWNLOAD_DIRECTORY, PLOTLYJS_FILENAME)
+    
+    # exported figures are written when they're first downloaded
+    key = os.path.splitext(path)[0]
+    if not (key.startswith('figure-') and key[7:].isalnum()):
+        abort(404)
+    t = request.args.get('t', type = float)
+    if t is None:
+        filename = key + '.html'
+    else:
+        filename = key + '_' + repr(t) + '.html'
+    
+    if not os.path.exists(os.path.join(DOWNLOAD_DIRECTORY, filename)):
+        try:
+            fig = get_export_figure(key, t)
+        except KeyError:
+            abort(404)
+        
+        def write_figure(tmpPath):
+            pio.write_html(fig, tmpPath, include_plotlyjs = request.url_root \
+                           + 'download/' + PLOTLYJS_FILENAME)
+        write_download_file(filename, write_figure)
+        prune_download_directory(EXPORT_CACHE_SIZE)
+    
+    return send_from_directory(DOWNLOAD_DIRECTORY, filename,
+                               as_attachment=True)
 
 #%% app layout
 
@@ -434,6 +701,7 @@ app.layout = html.Div(id='kspti-body', children = [
                         },
                     multiple=False
                     ),
+                html.Div(id='systemStatus-div'),
                 ]),
             dcc.Tab(label='Time Settings', className='control-tab', value='time', children=[
                 html.H3('Time Settings'),
@@ -532,6 +800,7 @@ app.layout = html.Div(id='kspti-body', children = [
                         n_clicks = 0
                 ),
             ),
+        html.Div(id = 'jobStatus-div'),
         dcc.Checklist(
             id = 'display-checklist',
             value = ['orbits', '3dSurfs', 'SoIs', 'arrows'],
@@ -543,7 +812,8 @@ app.layout = html.Div(id='kspti-body', children = [
                 {'label': 'Apses', 'value': 'apses'},
                 {'label': 'Nodes', 'value': 'nodes'},
                 {'label': 'Reference Direction', 'value': 'ref'},
-                {'label': 'Surface Projection Plot', 'value': 'surfProj'}
+                {'label': 'Surface Projection Plot', 'value': 'surfProj'},
+                {'label': 'Merge Traces', 'value': 'batch'}
                 ],
             labelStyle={'display': 'inline-block'},
             ),
@@ -561,18 +831,14 @@ app.layout = html.Div(id='kspti-body', children = [
     # hidden containers
     html.Div(id='orbits-div', style = {'display': 'none'}),
     html.Div(id='dateFormat-div', style = {'display': 'none'}),
-    html.Div(id='originalSystems-div', style = {'display': 'none'},
-             children=[
-                 jsonpickle.encode(kerbol_system),
-                 jsonpickle.encode(sol_system)]),
     html.Div(id='allSystems-div', style = {'display': 'none'},
              children=[
-                 jsonpickle.encode(kerbol_system),
-                 jsonpickle.encode(outer_planets_system),
-                 jsonpickle.encode(sol_system),
-                 jsonpickle.encode(kerbol_system)]),
+                 'stock-encoded',
+                 'opm-encoded',
+                 'rss-encoded',
+                 'stock-encoded']),
     html.Div(id='system-div', style={'display': 'none',}, 
-             children=jsonpickle.encode(kerbol_system)),
+             children='stock'),
     html.Div(id='orbitStartTimes-div', style={'display': 'none'},
              children=[]),
     html.Div(id='orbitEndTimes-div', style={'display': 'none'},
@@ -587,6 +853,9 @@ app.layout = html.Div(id='kspti-body', children = [
              children=[0]),
     html.Div(id='persistenceCrafts-div', style={'display': 'none'},
              children=[]),
+    html.Div(id='job-div', style={'display': 'none'}),
+    dcc.Store(id='craftSpecs-store', data=[]),
+    dcc.Interval(id='job-interval', interval=500, disabled=True),
     ])
   ])
 
@@ -633,12 +902,15 @@ def add_system_from_ini(iniFile, allSystems, radioOptions):
     iniFile = b64decode(iniFile).decode('utf-8')
     newSystem = ini_to_system(iniFile, False)
     
-    allSystems[3] = jsonpickle.encode(newSystem)
+    encodedSystem = jsonpickle.encode(newSystem)
+    systemHash = hashlib.sha1(encodedSystem.encode('utf-8')).hexdigest()
+    allSystems[3] = system_store.put(encodedSystem, 'upload-'+systemHash)
     
     return allSystems, 'upload'
 
 @app.callback(
-     Output('system-div', 'children'),
+    [Output('system-div', 'children'),
+     Output('systemStatus-div', 'children')],
     [Input('system-radio','value'),
      Input('systemResize-input','value'),
      Input('systemRescale-input','value'),
@@ -646,21 +918,20 @@ def add_system_from_ini(iniFile, allSystems, radioOptions):
     )
 def set_system(system_name, resizeFactor, rescaleFactor, all_systems):
     if system_name == 'stock':
-        system = jsonpickle.decode(all_systems[0])
+        encodedKey = all_systems[0]
     elif system_name == 'opm':
-        system = jsonpickle.decode(all_systems[1])
+        encodedKey = all_systems[1]
     elif system_name == 'rss':
-        system = jsonpickle.decode(all_systems[2])
+        encodedKey = all_systems[2]
     elif system_name == 'upload':
-        system = jsonpickle.decode(all_systems[3])
+        encodedKey = all_systems[3]
     else:
-        return dash.no_update
-    
-    for body in system:
-        body.resize(resizeFactor)
-        body.rescale(rescaleFactor)
+        return dash.no_update, dash.no_update
     
-    return jsonpickle.encode(system)
+    try:
+        return get_system(encodedKey, resizeFactor, rescaleFactor), ''
+    except KeyError:
+        return dash.no_update, SYSTEM_LOST_MESSAGE
 
 @app.callback(
      Output('numCrafts-div','children'),
@@ -678,7 +949,7 @@ def update_num_crafts(numCrafts, prevNumCrafts):
     [Input('system-div', 'children')]
     )
 def update_ref_body_dropdown(system):
-    system = jsonpickle.decode(system)
+    system = get_stored_system(system)
     return name_options(system)
 
 @app.callback(
@@ -694,6 +965,7 @@ def update_craft_name(name):
     [State({'type': 'nodes-div', 'index': MATCH}, 'children')]
     )
 def update_num_nodes(numNodes, prevNodesChildren):
+    index = dash.callback_context.inputs_list[0]['id']['index']
     try:
         prevNumNodes = int(len(prevNodesChildren)/5)
     except:
@@ -703,12 +975,59 @@ def update_num_nodes(numNodes, prevNodesChildren):
     elif numNodes > prevNumNodes:
         newChildren = prevNodesChildren
         for ii in range(numNodes-prevNumNodes):
-            add_maneuver_node(newChildren, ii+prevNumNodes+1)
+            add_maneuver_node(newChildren, ii+prevNumNodes+1, index)
     else:
         return dash.no_update
     
     return newChildren
 
+@app.callback(
+     Output('craftSpecs-store', 'data'),
+    [Input({'type': 'name-input', 'index': ALL}, 'value'),
+     Input({'type': 'red-input', 'index': ALL}, 'value'),
+     Input({'type': 'grn-input', 'index': ALL}, 'value'),
+     Input({'type': 'blu-input', 'index': ALL}, 'value'),
+     Input({'type': 'refBody-dropdown', 'index': ALL}, 'value'),
+     Input({'type': 'sma-input', 'index': ALL}, 'value'),
+     Input({'type': 'ecc-input', 'index': ALL}, 'value'),
+     Input({'type': 'inc-input', 'index': ALL}, 'value'),
+     Input({'type': 'argp-input', 'index': ALL}, 'value'),
+     Input({'type': 'lan-input', 'index': ALL}, 'value'),
+     Input({'type': 'mo-input', 'index': ALL}, 'value'),
+     Input({'type': 'epc-input', 'index': ALL}, 'value'),
+     Input({'type': 'prograde-input', 'index': ALL, 'node': ALL}, 'value'),
+     Input({'type': 'normal-input', 'index': ALL, 'node': ALL}, 'value'),
+     Input({'type': 'radial-input', 'index': ALL, 'node': ALL}, 'value'),
+     Input({'type': 'nodeTime-input', 'index': ALL, 'node': ALL}, 'value')]
+    )
+def update_craft_specs(names, reds, grns, blus, primNames,
+                       smas, eccs, incs, argps, lans, mos, epochs,
+                       progrades, normals, radials, nodeTimes):
+    """Collects the inputs of the craft tabs into a list of craft
+    specifications, so the plotting callbacks don't need the tabs' whole
+    component tree."""
+    
+    ctx = dash.callback_context
+    
+    # maneuver nodes of each craft, in order
+    craftNodes = dict()
+    nodeIds = [inp['id'] for inp in ctx.inputs_list[12]]
+    for ii, nodeId in enumerate(nodeIds):
+        craftNodes.setdefault(nodeId['index'], []).append(
+            (nodeId['node'],
+             [progrades[ii], normals[ii], radials[ii], nodeTimes[ii]]))
+    
+    specs = []
+    for ii, inp in enumerate(ctx.inputs_list[0]):
+        index = inp['id']['index']
+        nodes = [node for num, node in sorted(craftNodes.get(index, []))]
+        specs.append(dict(index = index, name = names[ii],
+                          color = [reds[ii], grns[ii], blus[ii]],
+                          prim = primNames[ii], a = smas[ii], ecc = eccs[ii],
+                          inc = incs[ii], argp = argps[ii], lan = lans[ii],
+                          mo = mos[ii], epoch = epochs[ii], nodes = nodes))
+    return specs
+
 @app.callback(
     [Output('craft-tabs','children'),
      Output('craft-tabs','value'),
@@ -729,7 +1048,7 @@ def update_craft_tabs(numCrafts,
                        prevCraftTabs, prevTabVal, system,
                        addCraftName, persistenceCrafts):
     
-    system = jsonpickle.decode(system)
+    system = get_stored_system(system)
     prevNumCrafts = len(prevCraftTabs)
     
     tabIdxs = []
@@ -738,7 +1057,7 @@ def update_craft_tabs(numCrafts,
     
     ctx = dash.callback_context
     if ctx.triggered[0]['prop_id'].split('.')[0] == 'addPersistenceCraft-button':
-        persistenceCrafts = jsonpickle.decode(persistenceCrafts)
+        persistenceCrafts = get_stored(persistenceCrafts)
         craft = [vs for vs in persistenceCrafts if vs.name == addCraftName][0]
         
         craftTabs = prevCraftTabs
@@ -811,19 +1130,84 @@ def update_craft_tabs(numCrafts,
      Output('orbitEndTimes-div','children'),
      Output('plotSystems-div','children'),
      Output('systemStartTimes-div','children'),
-     Output('systemEndTimes-div','children')],
-    [Input('plot-button','n_clicks')],
+     Output('systemEndTimes-div','children'),
+     Output('job-div','children'),
+     Output('job-interval','disabled'),
+     Output('jobStatus-div','children')],
+    [Input('plot-button','n_clicks'),
+     Input('job-interval','n_intervals')],
     [State('system-div','children'),
-     State('craft-tabs','children'),
+     State('craftSpecs-store','data'),
      State('numRevs-input','value'),
      State('startTime-input','value'),
-     State('endTime-input','value')]
+     State('endTime-input','value'),
+     State('job-div','children')]
     )
-def update_orbits(nClicks, system, craftTabs, numRevs, startTime, endTime):
+def update_orbits(nClicks, nIntervals, system, craftSpecs, numRevs,
+                  startTime, endTime, jobId):
     
     # don't update on page load
     if nClicks == 0:
-        return dash.no_update
+        raise PreventUpdate
+    
+    noOrbits = [dash.no_update]*6
+    
+    # submit the calculation, then poll for its result
+    ctx = dash.callback_context
+    if ctx.triggered[0]['prop_id'].split('.')[0] == 'plot-button':
+        # the previous calculation's result won't be collected anymore
+        if not jobId is None:
+            job_queue.forget(jobId)
+        try:
+            systemSource = system_store.get(system + '-source')
+            jobId = job_queue.submit(compute_orbits, system,
+                                     load_system(system), systemSource,
+                                     craftSpecs, numRevs, startTime, endTime)
+        except KeyError:
+            return noOrbits + [None, True, SYSTEM_LOST_MESSAGE]
+        return noOrbits + [jobId, False, job_queue.get_status(jobId)[1]]
+    
+    if jobId is None:
+        raise PreventUpdate
+    
+    status, message = job_queue.get_status(jobId)
+    if status == 'done':
+        try:
+            return list(job_queue.collect(jobId)) + [None, True, '']
+        except KeyError:
+            status = 'unknown'
+    if status == 'failed':
+        job_queue.forget(jobId)
+        return noOrbits + [None, True, message]
+    elif status == 'unknown':
+        return noOrbits + [None, True,
+                           'The calculation was lost. Please plot again.']
+    else:
+        return noOrbits + [dash.no_update, dash.no_update, message]
+
+def get_chain_key(systemKey, orb, numRevs, startTime, endTime):
+    """Returns the session store key for the propagated patches of a craft
+    with the given starting orbit and propagation settings."""
+    
+    chainId = repr((systemKey, orb.prim.name, orb.a, orb.ecc, orb.inc,
+                    orb.argp, orb.lan, orb.mo, orb.epoch,
+                    numRevs, startTime, endTime))
+    return 'chain-' + hashlib.sha1(chainId.encode('utf-8')).hexdigest()
+
+def compute_orbits(systemKey, system, systemSource, craftSpecs, numRevs,
+                   startTime, endTime):
+    """Propagates the trajectories of the crafts in the craft specifications.
+    
+    Each craft's patches are stored, so that when only its later maneuver
+    nodes change, the next propagation continues from the unchanged patches.
+    The propagation workers decode the system from its source, the key of
+    its encoded system and its scale factors.
+    
+    Returns:
+        the session store key of the crafts' orbits, the start and end times
+        of each orbit, the names of the primary bodies with craft orbits,
+        and the start and end times of the trajectories around each primary
+    """
     
     craftOrbits = []
     craftTimes = []
@@ -833,130 +1217,59 @@ def update_orbits(nClicks, system, craftTabs, numRevs, startTime, endTime):
     orbitStartTimes = []
     orbitEndTimes = []
     
-    for tab in craftTabs:
-        
-        # get parameters from tab children
-        startBodyName = tab['props']['children'][3]['props']['children'][0]['props']['children'][2]['props']['value']
-        startA = tab['props']['children'][3]['props']['children'][0]['props']['children'][4]['props']['value']
-        startEcc = tab['props']['children'][3]['props']['children'][0]['props']['children'][6]['props']['value']
-        startInc = tab['props']['children'][3]['props']['children'][0]['props']['children'][8]['props']['value']
-        startArgP = tab['props']['children'][3]['props']['children'][0]['props']['children'][10]['props']['value']
-        startLAN = tab['props']['children'][3]['props']['children'][0]['props']['children'][12]['props']['value']
-        startMo = tab['props']['children'][3]['props']['children'][0]['props']['children'][14]['props']['value']
-        startEpoch = tab['props']['children'][3]['props']['children'][0]['props']['children'][16]['props']['value']
-        
-        nodesChildren = tab['props']['children'][3]['props']['children'][1]['props']['children'][3]['props']['children']
-        
-        # prepare system information, start body
-        if not isinstance(system, list):
-            system = jsonpickle.decode(system)
-        sBody = [x for x in system if x.name == startBodyName][0]
-        
-        # prepare start and end orbit parameters
-        if startA is None:
-            startA = sBody.eqr + 100000
-        if startEcc is None:
-            startEcc = 0
-        if startInc is None:
-            startInc = 0
-        if startArgP is None:
-            startArgP = 0
-        if startLAN is None:
-            startLAN = 0
-        if startMo is None:
-            startMo = 0
-        if startEpoch is None:
-            startEpoch = 0
-        
-        sOrb = Orbit(startA, startEcc, startInc*math.pi/180, startArgP*math.pi/180,
-                     startLAN*math.pi/180, startMo, startEpoch, sBody)
-        
-        # prepare maneuver nodes
-        nodeBurns = []
-        nodeTimes = []
-        for ii in range(int(len(nodesChildren)/5)):
-            nodeBurns.append([nodesChildren[5*ii+1]["props"]["value"],
-                              nodesChildren[5*ii+2]["props"]["value"],
-                              nodesChildren[5*ii+3]["props"]["value"],
-                              ])
-            nodeTimes.append(nodesChildren[5*ii+4]['props']['value'])
+    crafts = [get_craft_from_spec(spec, system) for spec in craftSpecs]
+    
+    # find patches that are unchanged since the last propagation
+    chainKeys = []
+    prefixes = []
+    results = []
+    for craft in crafts:
+        chainKey = get_chain_key(systemKey, craft.orb, numRevs,
+                                 startTime, endTime)
+        try:
+            prefix, unchanged = craft.get_reusable_patches(
+                session_store.get(chainKey), startTime)
+        except KeyError:
+            prefix, unchanged = None, False
+        chainKeys.append(chainKey)
+        prefixes.append(prefix)
+        if unchanged:
+            results.append(prefix + (0,))
+        else:
+            results.append(None)
+    
+    # propagate the rest of the crafts' trajectories in parallel
+    propIdxs = [ii for ii in range(len(crafts)) if results[ii] is None]
+    encodedKey, resizeFactor, rescaleFactor = systemSource
+    if encodedKey in PRESET_KEYS:
+        encodedSystem = None
+    else:
+        try:
+            encodedSystem = system_store.get(encodedKey)
+        except KeyError:
+            raise ValueError(SYSTEM_LOST_MESSAGE)
+    propResults = propagate_crafts([craftSpecs[ii] for ii in propIdxs],
+                                   system, numRevs, startTime, endTime,
+                                   propagation_pool,
+                                   (systemKey, encodedKey, resizeFactor,
+                                    rescaleFactor, encodedSystem),
+                                   [prefixes[ii] for ii in propIdxs])
+    for ii, result in zip(propIdxs, propResults):
+        results[ii] = result
+    
+    for craft, chainKey, prefix, (orbits, times, nodeCounts, elapsed) in    \
+        zip(crafts, chainKeys, prefixes, results):
         
-        # set starting orbit and time
-        orbits = [sOrb]
-        if startTime is None:
-            if len(nodeTimes)==0:
-                times = [startEpoch]
-            else:
-                times = [np.amin(nodeTimes) - sOrb.get_period()]
+        if prefix is None:
+            numReused = 0
         else:
-            if not len(nodeTimes)==0:
-                if np.amin(nodeTimes) < startTime:
-                    times = [np.amin(nodeTimes)]
-                else:
-                    times = [startTime]
-            else:
-                times = [startTime]
+            numReused = len(prefix[0])
+        print('Propagated {} in {:.3f} s ({} patches reused)'.format(
+            craft.name, elapsed, numReused))
         
-        # propagate orbit and apply maneuver nodes
-        nodeIdx = 0
-        stopSearch = False
-        while not stopSearch:
-            t = times[-1]
-            nextOrb, time = orbits[-1].propagate(t+0.1)
-            
-            # try future revolutions if no new escape/encounter in first rev
-            if nextOrb is None and orbits[-1].ecc<1:
-                for ii in range(numRevs):
-                    t = t + orbits[-1].get_period()
-                    nextOrb, time = orbits[-1].propagate(t+0.1)
-                    if not nextOrb is None:
-                        break
-            
-            # if no escape/encounter, apply next maneuver node
-            if nextOrb is None:
-                if nodeIdx < len(nodeTimes):
-                    time = nodeTimes[nodeIdx]
-                    pos, vel = orbits[-1].get_state_vector(time)
-                    burn = burn_components_to_absolute(nodeBurns[nodeIdx][0],
-                                                       nodeBurns[nodeIdx][1],
-                                                       nodeBurns[nodeIdx][2],
-                                                       pos, vel)
-                    nextOrb = Orbit.from_state_vector(pos, vel+burn, time,  \
-                                                      orbits[-1].prim);
-                    orbits.append(nextOrb)
-                    times.append(time)
-                    nodeIdx = nodeIdx+1
-            
-            # otherwise, check if a maneuver happens before escape/encounter
-            else:
-                t = time
-                if nodeIdx < len(nodeTimes):
-                    if t > nodeTimes[nodeIdx]:
-                        time = nodeTimes[nodeIdx]
-                        pos, vel = orbits[-1].get_state_vector(time)
-                        burn = burn_components_to_absolute(nodeBurns[nodeIdx][0],
-                                                           nodeBurns[nodeIdx][1],
-                                                           nodeBurns[nodeIdx][2],
-                                                           pos, vel)
-                        nextOrb = Orbit.from_state_vector(pos, vel+burn, time,  \
-                                                          orbits[-1].prim);
-                        orbits.append(nextOrb)
-                        times.append(time)
-                        nodeIdx = nodeIdx+1
-                    else:
-                        orbits.append(nextOrb)
-                        times.append(time)
-                else:
-                    orbits.append(nextOrb)
-                    times.append(time)
-            
-            if not endTime is None:
-                if t > endTime:
-                    stopSearch = True
-            
-            # end search if no maneuvers left and no escape/encounter found
-            if (nextOrb is None and nodeIdx >= len(nodeTimes)):
-                stopSearch = True
+        session_store.put(dict(nodes = craft.get_nodes(), orbits = orbits,
+                               times = times, nodeCounts = nodeCounts),
+                          chainKey)
         
         craftOrbits.append(orbits)
         craftTimes.append(times)
@@ -1007,7 +1320,7 @@ def update_orbits(nClicks, system, craftTabs, numRevs, startTime, endTime):
         orbitStartTimes.append(sTimes)
         orbitEndTimes.append(eTimes)
     
-    return jsonpickle.encode(craftOrbits), orbitStartTimes, orbitEndTimes,  \
+    return session_store.put(craftOrbits), orbitStartTimes, orbitEndTimes, \
            systems, sliderStartTimes, sliderEndTimes
 
 @app.callback(
@@ -1035,73 +1348,144 @@ def update_graph_tabs(systems, sliderStartTimes, sliderEndTimes):
     return tabs, tabVal
 
 @app.callback(
-    [Output({'type': 'system-graph', 'index': MATCH}, 'figure'),
-     Output({'type': 'orbitDownload-button', 'index': MATCH}, 'href'),
+    [Output({'type': 'orbitStatic-store', 'index': MATCH}, 'data'),
+     Output({'type': 'orbitDynamic-store', 'index': MATCH}, 'data'),
+     Output({'type': 'orbitStaticKey-div', 'index': MATCH}, 'children'),
      Output({'type': 'tab-orb-rendered', 'index': MATCH}, 'children')],
     [Input('graph-tabs', 'value'),
-     Input({'type': 'plotTime-slider', 'index': MATCH}, 'value'),
+     Input({'type': 'plotTime-slider', 'index': MATCH}, 'max'),
      Input('display-checklist','value'),
      Input('dateFormat-div','children'),
      Input('surfaceTexture-radio', 'value')],
-    [State('startTime-input', 'value'),
+    [State({'type': 'plotTime-slider', 'index': MATCH}, 'value'),
+     State('startTime-input', 'value'),
      State('endTime-input', 'value'),
      State('orbits-div','children'),
      State('orbitStartTimes-div','children'),
      State('orbitEndTimes-div', 'children'),
      State('plotSystems-div', 'children'),
-     State('craft-tabs', 'children'),
+     State('systemStartTimes-div', 'children'),
+     State('craftSpecs-store', 'data'),
      State('system-div', 'children'),
+     State({'type': 'orbitStaticKey-div', 'index': MATCH}, 'children'),
      State({'type': 'tab-orb-rendered', 'index': MATCH}, 'children')]
     )
-def update_orbit_graph(systemName, sliderTime, displays, dateFormat,
+def update_orbit_graph(systemName, sliderMax, displays, dateFormat,
                        surfaceTextureType, 
-                       startTime, endTime,
+                       sliderTime, startTime, endTime,
                        orbitsTimes, orbitStartTimes, orbitEndTimes,
-                       plotSystems, craftTabs, system,
-                       orbRendered):
+                       plotSystems, systemStartTimes, craftSpecs, system,
+                       prevStaticKey, orbRendered):
     
     ctx = dash.callback_context
     tabTrigger = ctx.triggered[0]['prop_id'].split('.')[0] == 'graph-tabs'
     
     figIdx = ctx.inputs_list[1]['id']['index']
-    craftOrbits = jsonpickle.decode(orbitsTimes)
-    system = jsonpickle.decode(system)
+    craftOrbits = get_stored(orbitsTimes)
+    systemKey = system
+    system = get_stored_system(system)
     
     primaryName = plotSystems[figIdx]
     if systemName == 'Solar':
         systemName = 'Sun'
     
     if (not primaryName == systemName) or (orbRendered[0] and tabTrigger):
-        return dash.no_update, dash.no_update, dash.no_update
+        return dash.no_update, dash.no_update, dash.no_update,              \
+               dash.no_update
     
     primaryBody = [x for x in system if x.name == primaryName][0]
     
-    fig = go.Figure()
-    lim = plot_system(fig, primaryBody, sliderTime,                         \
-                      dateFormat, displays, surfaceTextureType);
-    set_trajectory_plot_layout(fig, lim, uirev = primaryBody.name)
-    
+    # prepare craft names, colors, and maneuver nodes
+    craftNames = []
+    craftColors = []
+    craftNodeBurns = []
+    craftNodeTimes = []
     for nn in range(len(craftOrbits)):
+        craftNames.append(craftSpecs[nn]['name'])
+        craftColors.append(tuple(craftSpecs[nn]['color']))
+        craftNodeBurns.append([node[0:3] for node in craftSpecs[nn]['nodes']])
+        craftNodeTimes.append([node[3] for node in craftSpecs[nn]['nodes']])
+    
+    # the static layers (orbits, apses, nodes, primary body, reference line,
+    # and burn arrows) only depend on the system, trajectories, and display
+    # options, so they're reused for every slider time
+    refTime = systemStartTimes[figIdx]
+    staticKey = get_figure_key(system=systemKey, orbits=orbitsTimes,
+                               primary=primaryName, displays=sorted(displays),
+                               dateFormat=sorted(dateFormat.items()),
+                               surfTexture=surfaceTextureType,
+                               refTime=refTime,
+                               startTime=startTime, names=craftNames,
+                               colors=craftColors, burns=craftNodeBurns,
+                               times=craftNodeTimes)
+    try:
+        staticLayers = session_store.get(staticKey)
+    except KeyError:
+        staticFig = go.Figure()
+        lim = plot_system_static(staticFig, primaryBody, refTime,           \
+                                 dateFormat, displays, surfaceTextureType)
+        set_trajectory_plot_layout(staticFig, lim, uirev = primaryBody.name)
         
-        craftName = craftTabs[nn]['props']['label']
+        for nn in range(len(craftOrbits)):
+            
+            orbits = craftOrbits[nn]
+            sTimes = orbitStartTimes[nn]
+            eTimes = orbitEndTimes[nn]
+            
+            for ii in range(len(sTimes)):
+                orb = orbits[ii]
+                sTime = sTimes[ii]
+                eTime = eTimes[ii]
+                
+                if not ((sTime is None) or (eTime is None)) and             \
+                   orb.prim.name==primaryBody.name:
+                    
+                    if not startTime is None:
+                        if eTime < startTime:
+                            continue
+                        elif sTime < startTime:
+                            sTime = startTime
+                    
+                    # draw orbits
+                    if 'orbits' in displays:
+                        add_orbit(staticFig, orb, sTime, eTime, ORBIT_SEED_POINTS,
+                              dateFormat, 'apses' in displays, 'nodes' in displays,
+                              fullPeriod=False, color=craftColors[nn],
+                              name=craftNames[nn], style='solid', fade=True,
+                              tol=lim*ORBIT_TOLERANCE,
+                              batch='batch' in displays)
+                    
+                    # add burn arrows
+                    if (eTime in craftNodeTimes[nn]) and ('arrows' in displays):
+                        burnIdx = craftNodeTimes[nn].index(eTime)
+                        burnDV = craftNodeBurns[nn][burnIdx]
+                        add_burn_arrow(staticFig, burnDV, eTime, orb, dateFormat,
+                                       1/2, 'Burn'+str(burnIdx+1),
+                                       craftColors[nn], False)
         
-        # prepare color
-        color = (                                                           \
-            craftTabs[nn]['props']['children'][2]['props']['children'][1]['props']['children'][1]['props']['value'],
-            craftTabs[nn]['props']['children'][2]['props']['children'][1]['props']['children'][2]['props']['value'],
-            craftTabs[nn]['props']['children'][2]['props']['children'][1]['props']['children'][3]['props']['value']
-                )
+        staticFig = staticFig.to_dict()
+        if 'batch' in displays:
+            staticFig['data'] = batch_traces(staticFig['data'])
         
-        # prepare maneuver nodes
-        nodesChildren = craftTabs[nn]['props']['children'][3]['props']['children'][1]['props']['children'][3]['props']['children']
-        nodeBurns = []
-        nodeTimes = []
-        for kk in range(int(len(nodesChildren)/5)):
-            nodeBurns.append([nodesChildren[5*kk+1]["props"]["value"],
-                              nodesChildren[5*kk+2]["props"]["value"],
-                              nodesChildren[5*kk+3]["props"]["value"],
-                              ])
-            nodeTimes.append(nodesChildren[5*kk+4]['props']['value'])
+        # the textured surface is rotated in the browser for other times
+        surfaceIdx = None
+        rotationRate = None
+        for idx, trace in enumerate(staticFig['data']):
+            if trace['type'] == 'surface':
+                surfaceIdx = idx
+                rotationRate = 2*math.pi/primaryBody.rotPeriod
+        
+        staticLayers = dict(key = staticKey, figure = staticFig,
+                            surfaceIdx = surfaceIdx, refTime = refTime,
+                            rotationRate = rotationRate)
+        session_store.put(staticLayers, staticKey)
+    
+    # the dynamic layers are drawn for the slider time, and moved to other
+    # slider times in the browser
+    fig = go.Figure()
+    motions = plot_system_dynamic(fig, primaryBody, sliderTime, displays)
+    
+    for nn in range(len(craftOrbits)):
         
         orbits = craftOrbits[nn]
         sTimes = orbitStartTimes[nn]
@@ -1121,110 +1505,92 @@ def update_orbit_graph(systemName, sliderTime, displays, dateFormat,
                     elif sTime < startTime:
                         sTime = startTime
                 
-                # draw orbits
-                if 'orbits' in displays:
-                    add_orbit(fig, orb, sTime, eTime, 201,
-                          dateFormat, 'apses' in displays, 'nodes' in displays,
-                          fullPeriod=False, color=color, name=craftName,
-                          style='solid', fade=True)
-                
-                # add burn arrows
-                if (eTime in nodeTimes) and ('arrows' in displays):
-                    burnIdx = nodeTimes.index(eTime)
-                    burnDV = nodeBurns[burnIdx]
-                    add_burn_arrow(fig, burnDV, eTime, orb, dateFormat,
-                                   1/2, 'Burn'+str(burnIdx+1), color, False)
+                # add craft marker, only visible during the orbit
+                if (ii==len(orbits)-1) and (orb.ecc<1):
+                    markerEndTime = None
+                else:
+                    markerEndTime = eTime
+                if (sTime<=sliderTime) and ((markerEndTime is None) or (sliderTime<eTime)):
+                    markerTime = sliderTime
+                    visible = True
+                else:
+                    markerTime = sTime
+                    visible = False
                 
-                # add craft marker
-                if (sTime<=sliderTime) and ((sliderTime<eTime) or ((ii==len(orbits)-1) and (orb.ecc<1))):
-                    craft = Body('Craft'+str(nn+1),0,0,0,orb=orb,color=color)
-                    add_body(fig, craft, sliderTime, False, size = 4, symbol = 'square')
-    
-    # create downloadable HTML file of orbit plot
-    orbitFilename = plotSystems[figIdx]+'_system.html'
-    orbitPath = os.path.join(DOWNLOAD_DIRECTORY, orbitFilename)
-    orbitLocation = "/download/{}".format(urlquote(orbitFilename))
-    fig.write_html(orbitPath)
-    
-    return fig, orbitLocation, [True]
+                # not attached to the orbit, so that the stored
+                # primary doesn't gain the craft as a satellite
+                craft = Body('Craft'+str(nn+1),0,0,0,color=craftColors[nn])
+                add_body(fig, craft, markerTime, False,
+                         pos = orb.get_state_vector(markerTime)[0],
+                         size = 4, symbol = 'square')
+                fig.data[-1].visible = visible
+                motions.append(get_trace_motion(orb, markerTime,
+                                                startTime = sTime,
+                                                endTime = markerEndTime))
+    
+    dynamicData = list(fig.to_dict()['data'])
+    if 'batch' in displays:
+        dynamicData, motions = batch_traces(dynamicData, motions)
+    
+    # the dynamic layers are stored so that the figure can be exported
+    # when it's downloaded. They're only needed for exports, so they are
+    # not written to the shared backend.
+    exportKey = get_figure_key(static = staticKey, time = sliderTime)
+    dynamicLayers = dict(key = staticKey, exportKey = exportKey,
+                         time = sliderTime,
+                         data = dynamicData,
+                         motions = motions)
+    session_store.put(dynamicLayers, exportKey, share = False)
+    
+    # only send the static layers if the browser doesn't already have them
+    if staticKey == prevStaticKey:
+        return dash.no_update, dynamicLayers, dash.no_update, [True]
+    else:
+        return staticLayers, dynamicLayers, staticKey, [True]
 
-@app.callback(
-    [Output({'type': 'surface-graph', 'index': MATCH}, 'figure'),
-     Output({'type': 'surface-graph', 'index': MATCH}, 'style'),
-     Output({'type': 'surfaceDownload-button', 'index': MATCH}, 'href'),
-     Output({'type': 'surfaceDownload-button', 'index': MATCH}, 'style'),
-     Output({'type': 'tab-surf-rendered', 'index': MATCH}, 'children')],
-    [Input('graph-tabs', 'value'),
-     Input({'type': 'plotTime-slider', 'index': MATCH}, 'value'),
-     Input('display-checklist','value'),
-     Input('dateFormat-div','children'),
-     Input('numSurfaceRevsBefore-input','value'),
-     Input('numSurfaceRevsAfter-input','value'),
-     Input('surfaceMap-radio', 'value')],
-    [State('startTime-input', 'value'),
-     State('endTime-input', 'value'),
-     State('orbits-div','children'),
-     State('orbitStartTimes-div','children'),
-     State('orbitEndTimes-div', 'children'),
-     State('plotSystems-div', 'children'),
-     State('craft-tabs', 'children'),
-     State('system-div', 'children'),
-     State({'type': 'tab-surf-rendered', 'index': MATCH}, 'children')]
+# the browser moves the bodies and crafts to the slider time and combines
+# the static and dynamic layers of the orbit graph, so that slider changes
+# don't need the server
+app.clientside_callback(
+    ClientsideFunction(namespace = 'figures',
+                       function_name = 'combine_figure_layers'),
+    Output({'type': 'system-graph', 'index': MATCH}, 'figure'),
+    [Input({'type': 'orbitStatic-store', 'index': MATCH}, 'data'),
+     Input({'type': 'orbitDynamic-store', 'index': MATCH}, 'data'),
+     Input({'type': 'plotTime-slider', 'index': MATCH}, 'value')]
     )
-def update_surface_graph(systemName, sliderTime, displays, dateFormat,
-                       numSurfaceRevsBefore, numSurfaceRevsAfter,
-                       surfaceMapType,
-                       startTime, endTime,
-                       orbitsTimes, orbitStartTimes, orbitEndTimes,
-                       plotSystems, craftTabs, system,
-                       surfRendered):
-    
-    ctx = dash.callback_context
-    tabTrigger = ctx.triggered[0]['prop_id'].split('.')[0] == 'graph-tabs'
-    checkTrigger = ctx.triggered[0]['prop_id'].split('.')[0] == 'display-checklist'
-    
-    figIdx = ctx.inputs_list[1]['id']['index']
-    craftOrbits = jsonpickle.decode(orbitsTimes)
-    system = jsonpickle.decode(system)
-    
-    primaryName = plotSystems[figIdx]
-    if systemName == 'Solar':
-        systemName = 'Sun'
-    
-    if 'surfProj' in displays:
-        surfStyle = None
-        hidden = False
-    else:
-        surfStyle = {'display': 'none'}
-        hidden = True
-    
-    # Don't do anything if another tab is selected
-    if not (primaryName == systemName):
-        # print('   tab not selected')
-        return dash.no_update, dash.no_update, dash.no_update,              \
-               dash.no_update, dash.no_update;
-    
-    # Need to render again next time if it is hidden when the slider changes
-    # or other inputs change
-    if hidden and (not (tabTrigger or checkTrigger)):
-        # print('   set unrendered')
-        return dash.no_update, surfStyle, dash.no_update,              \
-               surfStyle, [False];
-    
-    # No need to rerender if only the tab/checks have changed and already 
-    # rendered
-    if surfRendered[0] and (tabTrigger or checkTrigger):
-        # print('   unchanged')
-        return dash.no_update, surfStyle, dash.no_update,              \
-               surfStyle, dash.no_update;
-    
-    # No need to rerender if hidden and only the tab has changed
-    if hidden and tabTrigger:
-        # print('   unchanged')
-        return dash.no_update, surfStyle, dash.no_update,              \
-               surfStyle, dash.no_update;
+
+# the download link exports the orbit graph at the slider time
+app.clientside_callback(
+    ClientsideFunction(namespace = 'figures',
+                       function_name = 'get_export_href'),
+    Output({'type': 'orbitDownload-button', 'index': MATCH}, 'href'),
+    [Input({'type': 'orbitDynamic-store', 'index': MATCH}, 'data'),
+     Input({'type': 'plotTime-slider', 'index': MATCH}, 'value')]
+    )
+
+# surface figures drawn recently, kept in memory up to SURFACE_MEMO_BYTES
+SURFACE_MEMO_BYTES = int(os.environ.get('SURFACE_MEMO_BYTES', 64*2**20))
+surface_memo = OrderedDict()
+surface_memo_lock = threading.Lock()
+
+def get_figure_size(fig):
+    """Returns the approximate size (bytes) of the data in a figure."""
+    size = 0
+    for trace in fig.data:
+        for value in trace.to_plotly_json().values():
+            if isinstance(value, (list, tuple, np.ndarray)):
+                size = size + 8*np.size(value)
+    return size
+
+def draw_surface_figure(system, craftOrbits, orbitStartTimes, orbitEndTimes,
+                        craftNames, craftColors, primaryName, sliderTime,
+                        numSurfaceRevsBefore, numSurfaceRevsAfter,
+                        surfaceMapType, startTime, endTime, projections):
+    """Returns the surface graph of a primary body, with the crafts'
+    positions at the slider time and, if projections is true, their ground
+    tracks."""
     
-    # print('   rerendered')
     primaryBody = [x for x in system if x.name == primaryName][0]
     
     surfFig = go.Figure()
@@ -1239,25 +1605,8 @@ def update_surface_graph(systemName, sliderTime, displays, dateFormat,
     
     for nn in range(len(craftOrbits)):
         
-        craftName = craftTabs[nn]['props']['label']
-        
-        # prepare color
-        color = (                                                           \
-            craftTabs[nn]['props']['children'][2]['props']['children'][1]['props']['children'][1]['props']['value'],
-            craftTabs[nn]['props']['children'][2]['props']['children'][1]['props']['children'][2]['props']['value'],
-            craftTabs[nn]['props']['children'][2]['props']['children'][1]['props']['children'][3]['props']['value']
-                )
-        
-        # prepare maneuver nodes
-        nodesChildren = craftTabs[nn]['props']['children'][3]['props']['children'][1]['props']['children'][3]['props']['children']
-        nodeBurns = []
-        nodeTimes = []
-        for kk in range(int(len(nodesChildren)/5)):
-            nodeBurns.append([nodesChildren[5*kk+1]["props"]["value"],
-                              nodesChildren[5*kk+2]["props"]["value"],
-                              nodesChildren[5*kk+3]["props"]["value"],
-                              ])
-            nodeTimes.append(nodesChildren[5*kk+4]['props']['value'])
+        craftName = craftNames[nn]
+        color = craftColors[nn]
         
         orbits = craftOrbits[nn]
         sTimes = orbitStartTimes[nn]
@@ -1278,7 +1627,7 @@ def update_surface_graph(systemName, sliderTime, displays, dateFormat,
                         sTime = startTime
         
                 # surface projection
-                if surfStyle is None:
+                if projections:
                     if numSurfaceRevsBefore is None:
                         numSurfaceRevsBefore = 1
                     if numSurfaceRevsAfter is None:
@@ -1336,13 +1685,141 @@ def update_surface_graph(systemName, sliderTime, displays, dateFormat,
                                                   markerSize = 12,
                                                   borderColor='white')
     
+    return surfFig
+
+def get_surface_figure(inputs, system = None, craftOrbits = None):
+    """Returns the surface graph for its render inputs, drawing it only if
+    it isn't in memory.
+    
+    Args:
+        inputs (dict): keys of the system and the crafts' orbits, and the
+            other arguments of draw_surface_figure
+        system (list): the system, if it's already loaded
+        craftOrbits (list): the crafts' orbits, if they're already loaded
+    
+    Raises:
+        KeyError: if the system or the orbits aren't stored anymore
+    """
+    
+    key = get_figure_key(**inputs)
+    with surface_memo_lock:
+        if key in surface_memo:
+            surface_memo.move_to_end(key)
+            return surface_memo[key][0]
+    
+    if system is None:
+        system = load_system(inputs['system'])
+    if craftOrbits is None:
+        craftOrbits = session_store.get(inputs['orbits'])
+    drawInputs = dict(inputs)
+    del drawInputs['system'], drawInputs['orbits']
+    surfFig = draw_surface_figure(system, craftOrbits, **drawInputs)
+    
+    size = get_figure_size(surfFig)
+    with surface_memo_lock:
+        surface_memo[key] = (surfFig, size)
+        totalSize = sum(size for fig, size in surface_memo.values())
+        while totalSize > SURFACE_MEMO_BYTES and len(surface_memo) > 1:
+            totalSize = totalSize - surface_memo.popitem(last=False)[1][1]
+    return surfFig
 
+@app.callback(
+    [Output({'type': 'surface-graph', 'index': MATCH}, 'figure'),
+     Output({'type': 'surface-graph', 'index': MATCH}, 'style'),
+     Output({'type': 'surfaceDownload-button', 'index': MATCH}, 'href'),
+     Output({'type': 'surfaceDownload-button', 'index': MATCH}, 'style'),
+     Output({'type': 'tab-surf-rendered', 'index': MATCH}, 'children')],
+    [Input('graph-tabs', 'value'),
+     Input({'type': 'plotTime-slider', 'index': MATCH}, 'value'),
+     Input('display-checklist','value'),
+     Input('dateFormat-div','children'),
+     Input('numSurfaceRevsBefore-input','value'),
+     Input('numSurfaceRevsAfter-input','value'),
+     Input('surfaceMap-radio', 'value')],
+    [State('startTime-input', 'value'),
+     State('endTime-input', 'value'),
+     State('orbits-div','children'),
+     State('orbitStartTimes-div','children'),
+     State('orbitEndTimes-div', 'children'),
+     State('plotSystems-div', 'children'),
+     State('craftSpecs-store', 'data'),
+     State('system-div', 'children'),
+     State({'type': 'tab-surf-rendered', 'index': MATCH}, 'children')]
+    )
+def update_surface_graph(systemName, sliderTime, displays, dateFormat,
+                       numSurfaceRevsBefore, numSurfaceRevsAfter,
+                       surfaceMapType,
+                       startTime, endTime,
+                       orbitsTimes, orbitStartTimes, orbitEndTimes,
+                       plotSystems, craftSpecs, system,
+                       surfRendered):
+    
+    ctx = dash.callback_context
+    tabTrigger = ctx.triggered[0]['prop_id'].split('.')[0] == 'graph-tabs'
+    checkTrigger = ctx.triggered[0]['prop_id'].split('.')[0] == 'display-checklist'
+    
+    figIdx = ctx.inputs_list[1]['id']['index']
+    craftOrbits = get_stored(orbitsTimes)
+    systemKey = system
+    system = get_stored_system(system)
+    
+    primaryName = plotSystems[figIdx]
+    if systemName == 'Solar':
+        systemName = 'Sun'
+    
+    if 'surfProj' in displays:
+        surfStyle = None
+        hidden = False
+    else:
+        surfStyle = {'display': 'none'}
+        hidden = True
+    
+    # Don't do anything if another tab is selected
+    if not (primaryName == systemName):
+        # print('   tab not selected')
+        return dash.no_update, dash.no_update, dash.no_update,              \
+               dash.no_update, dash.no_update;
+    
+    # Need to render again next time if it is hidden when the slider changes
+    # or other inputs change
+    if hidden and (not (tabTrigger or checkTrigger)):
+        # print('   set unrendered')
+        return dash.no_update, surfStyle, dash.no_update,              \
+               surfStyle, [False];
+    
+    # No need to rerender if only the tab/checks have changed and already 
+    # rendered
+    if surfRendered[0] and (tabTrigger or checkTrigger):
+        # print('   unchanged')
+        return dash.no_update, surfStyle, dash.no_update,              \
+               surfStyle, dash.no_update;
+    
+    # No need to rerender if hidden and only the tab has changed
+    if hidden and tabTrigger:
+        # print('   unchanged')
+        return dash.no_update, surfStyle, dash.no_update,              \
+               surfStyle, dash.no_update;
     
-    # create downloadable HTML file of surface plot
-    surfFilename = plotSystems[figIdx]+'_surface.html'
-    surfPath = os.path.join(DOWNLOAD_DIRECTORY, surfFilename)
-    surfLocation = "/download/{}".format(urlquote(surfFilename))
-    surfFig.write_html(surfPath)
+    # the figure is only drawn the first time these inputs are rendered, and
+    # only its inputs are stored, so it can be drawn again when downloaded
+    surfInputs = dict(
+        system = systemKey, orbits = orbitsTimes,
+        orbitStartTimes = orbitStartTimes, orbitEndTimes = orbitEndTimes,
+        craftNames = [spec['name'] for spec in craftSpecs[:len(craftOrbits)]],
+        craftColors = [tuple(spec['color'])
+                       for spec in craftSpecs[:len(craftOrbits)]],
+        primaryName = primaryName, sliderTime = sliderTime,
+        numSurfaceRevsBefore = numSurfaceRevsBefore,
+        numSurfaceRevsAfter = numSurfaceRevsAfter,
+        surfaceMapType = surfaceMapType,
+        startTime = startTime, endTime = endTime,
+        projections = not hidden)
+    surfFig = get_surface_figure(surfInputs, system, craftOrbits)
+    surfKey = get_figure_key(**surfInputs)
+    surfLocation = "/download/{}.html".format(surfKey)
+    
+    # the inputs are stored, so the figure can be exported when downloaded
+    session_store.put(dict(surface = surfInputs), surfKey, share = False)
     
     return surfFig, surfStyle, surfLocation, surfStyle, [True]
 
@@ -1383,7 +1860,7 @@ def create_crafts_from_persistence_file(persistenceFile, system):
     if persistenceFile is None:
         return dash.no_update, dash.no_update, dash.no_update
     
-    system = jsonpickle.decode(system)
+    system = get_stored_system(system)
     persistenceFile = persistenceFile.split(',')[1]
     persistenceFile = b64decode(persistenceFile).decode('utf-8')
     sfsData = parse_savefile(persistenceFile, False)
@@ -1443,7 +1920,7 @@ def create_crafts_from_persistence_file(persistenceFile, system):
     
     craftOptions = name_options(crafts)
     
-    return jsonpickle.encode(crafts), craftOptions, crafts[0].name
+    return session_store.put(crafts), craftOptions, crafts[0].name
 
 #%% run app
 
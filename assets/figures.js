@@ -0,0 +1,203 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    figures: {
+        // Returns the mean anomaly of an orbit at time t.
+        // Mirrors Orbit.get_mean_anomaly in orbit.py.
+        get_mean_anomaly: function(orb, t) {
+            if (t === orb.epoch) {
+                return orb.mo;
+            }
+            var period = 2*Math.PI * Math.sqrt(Math.pow(Math.abs(orb.a), 3)/orb.mu);
+            var meanAnom = orb.mo + (t-orb.epoch) / (period/(2*Math.PI));
+            if (orb.ecc < 1 && (meanAnom < 0 || meanAnom >= 2*Math.PI)) {
+                meanAnom = meanAnom - 2*Math.PI*Math.floor(meanAnom/(2*Math.PI));
+            }
+            return meanAnom;
+        },
+
+        // Solves the inverse Kepler's equation for eccentric or hyperbolic
+        // anomaly. Mirrors Orbit.solve_Keplers in orbit.py.
+        solve_Keplers: function(meanAnom, ecc) {
+            var tol = 1E-12;
+            var maxIt = 1000;
+            var anom, anomPrev, it;
+            if (ecc < 1) {
+                anom = (ecc < 0.08) ? meanAnom : Math.PI;
+                anomPrev = (meanAnom+Math.PI)*4;
+                for (it = 0; Math.abs(anom-anomPrev) > tol && it < maxIt; it++) {
+                    anomPrev = anom;
+                    anom = anom - (anom - ecc*Math.sin(anom) - meanAnom) /
+                        (1-ecc*Math.cos(anom));
+                }
+            } else {
+                anom = (Math.abs(meanAnom) > 4*Math.PI) ?
+                    Math.sign(meanAnom)*4*Math.PI : meanAnom;
+                anomPrev = (meanAnom+Math.PI)*4;
+                for (it = 0; Math.abs(anom-anomPrev) > tol && it < maxIt; it++) {
+                    anomPrev = anom;
+                    anom = anom + (meanAnom - ecc*Math.sinh(anom) + anom) /
+                        (ecc*Math.cosh(anom) - 1);
+                    if (!isFinite(anom)) {
+                        anom = Math.PI;
+                    }
+                }
+            }
+            return anom;
+        },
+
+        // Returns the position vector of an orbit at time t.
+        // Mirrors Orbit.get_state_vector in orbit.py.
+        get_position: function(orb, t) {
+            if (orb === null) {
+                return [0, 0, 0];
+            }
+            var fn = window.dash_clientside.figures;
+            var ecc = orb.ecc;
+            var anom = fn.solve_Keplers(fn.get_mean_anomaly(orb, t), ecc);
+            var nu;
+            if (ecc < 1) {
+                nu = 2*Math.atan2(Math.sqrt(1+ecc)*Math.sin(anom/2),
+                                  Math.sqrt(1-ecc)*Math.cos(anom/2));
+            } else {
+                nu = Math.atan2(-orb.a*Math.sqrt(ecc*ecc-1)*Math.sinh(anom),
+                                -orb.a*(ecc-Math.cosh(anom)));
+            }
+            var rMag = orb.a*(1-ecc*ecc) / (1+ecc*Math.cos(nu));
+            var x = rMag*Math.cos(nu);
+            var y = rMag*Math.sin(nu);
+
+            // rotate by the argument of periapsis, inclination, and
+            // longitude of the ascending node
+            var cw = Math.cos(orb.argp), sw = Math.sin(orb.argp);
+            var ci = Math.cos(orb.inc), si = Math.sin(orb.inc);
+            var cl = Math.cos(orb.lan), sl = Math.sin(orb.lan);
+            var x1 = x*cw - y*sw;
+            var y1 = x*sw + y*cw;
+            var y2 = y1*ci;
+            var z2 = y1*si;
+            return [x1*cl - y2*sl, x1*sl + y2*cl, z2];
+        },
+
+        // Returns a copy of a dynamic trace moved from the time it was drawn
+        // for to time t, as described by its motion from get_trace_motion (or
+        // batch_traces) in plotutils.py.
+        move_trace: function(trace, motion, t) {
+            var fn = window.dash_clientside.figures;
+            var moved = Object.assign({}, trace);
+            if (motion.kind === 'batch') {
+                // move each merged trace's points, and hide the ones of
+                // traces that aren't visible at time t
+                moved.x = [];
+                moved.y = [];
+                moved.z = [];
+                motion.parts.forEach(function(part) {
+                    var end = part.start + part.count;
+                    var movedPart = fn.move_trace(
+                        {x: trace.x.slice(part.start, end),
+                         y: trace.y.slice(part.start, end),
+                         z: trace.z.slice(part.start, end)},
+                        part.motion, t);
+                    for (var i = 0; i < part.count; i++) {
+                        var hidden = movedPart.visible === false;
+                        moved.x.push(hidden ? null : movedPart.x[i]);
+                        moved.y.push(hidden ? null : movedPart.y[i]);
+                        moved.z.push(hidden ? null : movedPart.z[i]);
+                    }
+                });
+                return moved;
+            }
+            if (motion.startTime !== null || motion.endTime !== null) {
+                moved.visible = (motion.startTime === null ||
+                                 motion.startTime <= t) &&
+                                (motion.endTime === null || t < motion.endTime);
+                if (!moved.visible) {
+                    return moved;
+                }
+            }
+            if (t === motion.time || motion.orbit === null) {
+                return moved;
+            }
+
+            if (motion.kind === 'prograde') {
+                // redraw the trace centered at time t, as add_prograde_trace
+                var n = motion.numPts;
+                var times = [], pts = [];
+                for (var i = 0; i < n; i++) {
+                    times.push(t - motion.interval + 2*motion.interval*i/(n-1));
+                    pts.push(fn.get_position(motion.orbit, times[i]));
+                }
+                var mid = pts[Math.floor(n/2)];
+                moved.x = pts.map(function(p) {return p[0] - mid[0];});
+                moved.y = pts.map(function(p) {return p[1] - mid[1];});
+                moved.z = pts.map(function(p) {return p[2] - mid[2];});
+                moved.line = Object.assign({}, trace.line, {color: times});
+                return moved;
+            }
+
+            var pos = fn.get_position(motion.orbit, t);
+            var dx = pos[0] - motion.pos[0];
+            var dy = pos[1] - motion.pos[1];
+            var dz = pos[2] - motion.pos[2];
+            moved.x = trace.x.map(function(v) {return v + dx;});
+            moved.y = trace.y.map(function(v) {return v + dy;});
+            moved.z = trace.z.map(function(v) {return v + dz;});
+            return moved;
+        },
+
+        // Rotates a surface trace about the z-axis by an angle (radians).
+        // Mirrors rotate_surface_trace in plotutils.py.
+        rotate_surface_trace: function(trace, angle) {
+            var c = Math.cos(angle);
+            var s = Math.sin(angle);
+            var x = trace.x.map(function(row, i) {
+                return row.map(function(xij, j) {
+                    return xij*c - trace.y[i][j]*s;
+                });
+            });
+            var y = trace.x.map(function(row, i) {
+                return row.map(function(xij, j) {
+                    return xij*s + trace.y[i][j]*c;
+                });
+            });
+            return Object.assign({}, trace, {x: x, y: y});
+        },
+
+        // Combines the static and dynamic layers of the orbit graph, with
+        // the dynamic layers moved and the surface rotated to the slider
+        // time. Mirrors combine_figure_layers in app.py.
+        combine_figure_layers: function(staticLayers, dynamicLayers, sliderTime) {
+            if (!staticLayers || !dynamicLayers ||
+                staticLayers.key !== dynamicLayers.key) {
+                return window.dash_clientside.no_update;
+            }
+            var fn = window.dash_clientside.figures;
+            var t = (sliderTime === null || sliderTime === undefined) ?
+                dynamicLayers.time : sliderTime;
+
+            var data = staticLayers.figure.data.slice();
+            var idx = staticLayers.surfaceIdx;
+            if (idx !== null) {
+                var rotation = staticLayers.rotationRate *
+                    (t - staticLayers.refTime);
+                if (rotation !== 0) {
+                    data[idx] = fn.rotate_surface_trace(data[idx], rotation);
+                }
+            }
+
+            var dynamicData = dynamicLayers.data.map(function(trace, i) {
+                return fn.move_trace(trace, dynamicLayers.motions[i], t);
+            });
+            return {data: data.concat(dynamicData),
+                    layout: staticLayers.figure.layout};
+        },
+
+        // Returns the link that exports the orbit graph at the slider time.
+        get_export_href: function(dynamicLayers, sliderTime) {
+            if (!dynamicLayers) {
+                return window.dash_clientside.no_update;
+            }
+            var t = (sliderTime === null || sliderTime === undefined) ?
+                dynamicLayers.time : sliderTime;
+            return '/download/' + dynamicLayers.exportKey + '.html?t=' + t;
+        }
+    }
+});
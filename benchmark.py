@@ -0,0 +1,245 @@
+"""Benchmarks for transfer and porkchop table calculations.
+
+Runs a fixed set of transfers in the stock Kerbol, Outer Planets Mod, and
+Real Solar System systems, and reports the speed, number of Lambert solver
+iterations, and peak memory of each porkchop table. The delta v tables are
+compared against stored reference outputs. Memory-mapped tables sharing a
+storage directory are checked against tables held in memory.
+
+Usage:
+    python benchmark.py             run all cases and compare to reference
+    python benchmark.py --update    run all cases and store new reference
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import jsonpickle
+import numpy as np
+from orbit import Orbit
+from transfer import Transfer
+from prktable import PorkchopTable
+
+REFERENCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'benchmark_reference.npz')
+
+SYSTEM_FILES = dict(stock = 'kerbol_system.json',
+                    opm = 'outer_planets_system.json',
+                    rss = 'sol_system.json')
+
+# Each case is a start body and parking altitude (m), an end body and
+# parking altitude (m), and the inclination (°) of the starting orbit
+SCENARIOS = dict(
+    stock = {'same-primary':    ('Kerbin', 100000, 'Kerbin', 2863334, 10),
+             'moon-to-planet':  ('Mun', 20000, 'Kerbin', 100000, 0),
+             'planet-to-moon':  ('Kerbin', 100000, 'Mun', 20000, 6),
+             'interplanetary':  ('Kerbin', 100000, 'Duna', 60000, 0)},
+    opm =   {'same-primary':    ('Sarnus', 600000, 'Sarnus', 12000000, 10),
+             'moon-to-planet':  ('Tekto', 100000, 'Sarnus', 600000, 0),
+             'planet-to-moon':  ('Sarnus', 600000, 'Tekto', 100000, 6),
+             'interplanetary':  ('Kerbin', 100000, 'Sarnus', 600000, 0)},
+    rss =   {'same-primary':    ('Earth', 200000, 'Earth', 35786000, 28),
+             'moon-to-planet':  ('Moon', 100000, 'Earth', 200000, 0),
+             'planet-to-moon':  ('Earth', 200000, 'Moon', 100000, 28),
+             'interplanetary':  ('Earth', 200000, 'Mars', 300000, 0)},
+    )
+
+TRANSFER_TYPES = ['ballistic', 'plane change', 'optimal']
+GRID_SIZES = [5, 15]
+
+def load_system(systemName):
+    """Reads one of the preset systems from its json file."""
+    
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        SYSTEM_FILES[systemName])
+    infile = open(path,'r')
+    system = jsonpickle.decode(infile.read())
+    infile.close()
+    return system
+
+def make_orbits(system, scenario):
+    """Returns the starting and ending parking orbits of a case."""
+    
+    startName, startAlt, endName, endAlt, inc = scenario
+    startBody = [bd for bd in system if bd.name == startName][0]
+    endBody = [bd for bd in system if bd.name == endName][0]
+    
+    startOrb = Orbit(startBody.eqr+startAlt, 0, inc*np.pi/180, 0, 0, 0, 0,
+                     startBody)
+    endOrb = Orbit(endBody.eqr+endAlt, 0, 0, 0, 0, 0, 0, endBody)
+    return startOrb, endOrb
+
+def case_key(systemName, scenario, transferType, size):
+    return '/'.join([systemName, scenario, transferType, str(size)])
+
+def run_case(system, scenario, transferType, size, memory = True):
+    """Builds a porkchop table for one case and measures its cost.
+    
+    The table is built once for timing and, if memory is true, a second
+    time with memory tracing, which would otherwise slow down the timing.
+    
+    Returns:
+        the table of total delta v values and a dictionary of statistics
+    """
+    
+    startOrb, endOrb = make_orbits(system, scenario)
+    
+    Transfer.lambertIterations = 0
+    startClock = time.perf_counter()
+    table = PorkchopTable(startOrb, endOrb, transferType,
+                          startTimeSize = size, flightTimeSize = size)
+    elapsed = time.perf_counter() - startClock
+    lambertIterations = Transfer.lambertIterations
+    
+    if memory:
+        tracemalloc.start()
+        PorkchopTable(startOrb, endOrb, transferType,
+                      startTimeSize = size, flightTimeSize = size)
+        peakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        peakMemory = np.nan
+    
+    stats = dict(cellsPerSecond = size**2/elapsed,
+                 lambertIterations = lambertIterations,
+                 peakMemory = peakMemory)
+    return table.totalDeltaV, stats
+
+def run_benchmarks(systemNames = None, transferTypes = None, sizes = None,
+                   update = False, rtol = 1E-6, memory = True):
+    """Runs the benchmark cases and compares them to the stored reference.
+    
+    Returns:
+        the number of cases that differ from (or are missing in) the
+        reference
+    """
+    
+    if systemNames is None:
+        systemNames = list(SYSTEM_FILES.keys())
+    if transferTypes is None:
+        transferTypes = TRANSFER_TYPES
+    if sizes is None:
+        sizes = GRID_SIZES
+    
+    if os.path.exists(REFERENCE_PATH):
+        reference = dict(np.load(REFERENCE_PATH))
+    else:
+        reference = dict()
+    
+    print('{:<48}{:>12}{:>12}{:>12}  {}'.format(
+        'case', 'cells/s', 'lambert its', 'peak KiB', 'reference'))
+    
+    numFailed = 0
+    for systemName in systemNames:
+        system = load_system(systemName)
+        for scenario, case in SCENARIOS[systemName].items():
+            for transferType in transferTypes:
+                for size in sizes:
+                    key = case_key(systemName, scenario, transferType, size)
+                    deltaV, stats = run_case(system, case, transferType,
+                                             size, memory)
+                    
+                    if update:
+                        reference[key] = deltaV
+                        result = 'stored'
+                    elif not key in reference:
+                        result = 'missing'
+                        numFailed = numFailed + 1
+                    elif np.allclose(deltaV, reference[key], rtol = rtol,
+                                     equal_nan = True):
+                        result = 'ok'
+                    else:
+                        maxDiff = np.nanmax(np.abs(deltaV-reference[key]))
+                        result = 'DIFFERS (max {:.3g} m/s)'.format(maxDiff)
+                        numFailed = numFailed + 1
+                    
+                    print('{:<48}{:>12.1f}{:>12d}{:>12.0f}  {}'.format(
+                        key, stats['cellsPerSecond'],
+                        stats['lambertIterations'],
+                        stats['peakMemory']/1024, result))
+    
+    if update:
+        np.savez_compressed(REFERENCE_PATH, **reference)
+    
+    return numFailed
+
+def check_shared_storage(size = 5, tileSize = 2):
+    """Builds two memory-mapped tables in one storage directory, extends the
+    first, and compares both with the same tables held in memory. Closing
+    the tables must leave the directory empty.
+    
+    Returns:
+        the number of tables that differ, plus one if files are left over
+    """
+    
+    system = load_system('stock')
+    cases = [SCENARIOS['stock']['same-primary'],
+             SCENARIOS['stock']['interplanetary']]
+    
+    numFailed = 0
+    with tempfile.TemporaryDirectory() as storageDir:
+        stored = []
+        for case in cases:
+            startOrb, endOrb = make_orbits(system, case)
+            stored.append(PorkchopTable(startOrb, endOrb,
+                                        startTimeSize = size,
+                                        flightTimeSize = size,
+                                        storageDir = storageDir,
+                                        tileSize = tileSize))
+        startOrb, endOrb = make_orbits(system, cases[0])
+        inMemory = [PorkchopTable(startOrb, endOrb, startTimeSize = size,
+                                  flightTimeSize = size)]
+        startOrb, endOrb = make_orbits(system, cases[1])
+        inMemory.append(PorkchopTable(startOrb, endOrb,
+                                      startTimeSize = size,
+                                      flightTimeSize = size))
+        
+        # extending reuses the first table's samples
+        stored[0].extend(maxStartTime = 2*stored[0].maxStartTime)
+        inMemory[0].extend(maxStartTime = 2*inMemory[0].maxStartTime)
+        
+        for name, storedTable, memoryTable in zip(['first', 'second'],
+                                                  stored, inMemory):
+            if np.allclose(storedTable.totalDeltaV,
+                           memoryTable.totalDeltaV, equal_nan = True):
+                result = 'ok'
+            else:
+                result = 'DIFFERS'
+                numFailed = numFailed + 1
+            print('{:<48}{:>36}  {}'.format(
+                'shared storage/' + name + ' table', '', result))
+        
+        for table in stored:
+            table.close()
+        if len(os.listdir(storageDir)) == 0:
+            result = 'ok'
+        else:
+            result = 'FILES LEFT'
+            numFailed = numFailed + 1
+        print('{:<48}{:>36}  {}'.format('shared storage/closed tables', '',
+                                        result))
+    
+    return numFailed
+
+#%% run benchmarks
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('--update', action = 'store_true',
+                        help = 'store the results as the new reference')
+    parser.add_argument('--systems', nargs = '+',
+                        choices = list(SYSTEM_FILES.keys()))
+    parser.add_argument('--types', nargs = '+', choices = TRANSFER_TYPES)
+    parser.add_argument('--sizes', nargs = '+', type = int)
+    parser.add_argument('--rtol', type = float, default = 1E-6,
+                        help = 'relative tolerance for reference comparison')
+    parser.add_argument('--no-memory', action = 'store_true',
+                        help = 'skip the peak memory measurement')
+    args = parser.parse_args()
+    
+    numFailed = run_benchmarks(args.systems, args.types, args.sizes,
+                               args.update, args.rtol, not args.no_memory)
+    numFailed = numFailed + check_shared_storage()
+    sys.exit(1 if numFailed > 0 else 0)
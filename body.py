@@ -12,9 +12,12 @@ class Body:
         orb (Orbit): Keplerian orbit
         satellites (list): list of other bodies orbiting this one
         color (tuple): 3 ints for and RGB color for plotting
+        frozen (bool): whether the body can no longer be changed
         
     """
     
+    frozen = False
+    
     def __init__(self, name  = None, eqr = None, mu = None, soi = None, 
                  rotPeriod = None, rotIni = None,
                  orb = None, ref = None, satellites = None, 
@@ -43,6 +46,19 @@ class Body:
         else:
             self.satellites = satellites
     
+    def __setattr__(self, name, value):
+        if self.frozen:
+            raise AttributeError(
+                "can't change " + name + ' of frozen body ' + str(self.name))
+        object.__setattr__(self, name, value)
+    
+    def freeze(self):
+        """Prevents changes to the body, its orbit, and its list of
+        satellites, for bodies that are shared between sessions."""
+        self.satellites = tuple(self.satellites)
+        self.orb.freeze()
+        self.frozen = True
+    
     def set_soi(self, sma, mu, muPrim):
         self.soi = sma * (mu/muPrim)**(2/5)
     
@@ -1,5 +1,10 @@
+import math
+import numpy as np
+import jsonpickle
+from time import perf_counter
 from orbit import Orbit
 from body import Body
+from plotutils import burn_components_to_absolute
 
 class Craft:
     """Spacecraft defined by its orbit and maneuver nodes.
@@ -27,3 +32,333 @@ class Craft:
         if not self.orb.prim is None:
             if not(self in self.orb.prim.satellites):
                 self.orb.prim.satellites.append(self)
+    
+    def get_nodes(self):
+        if self.maneuverNodes is None:
+            return []
+        else:
+            return self.maneuverNodes
+    
+    def get_start_time(self, startTime = None):
+        """Returns the time at which the craft's trajectory begins."""
+        
+        nodeTimes = [node[3] for node in self.get_nodes()]
+        if startTime is None:
+            if len(nodeTimes)==0:
+                return self.orb.epoch
+            else:
+                return np.amin(nodeTimes) - self.orb.get_period()
+        else:
+            if not len(nodeTimes)==0:
+                if np.amin(nodeTimes) < startTime:
+                    return np.amin(nodeTimes)
+                else:
+                    return startTime
+            else:
+                return startTime
+    
+    def propagate(self, numRevs = 0, startTime = None, endTime = None,
+                  prefix = None):
+        """Follows the craft's trajectory through its maneuver nodes and
+        sphere of influence changes.
+        
+        Args:
+            numRevs (int): number of additional revolutions to search for an
+                escape or encounter before applying the next maneuver node
+            startTime (float): time to start the trajectory (s). If None,
+                starts one period before the first maneuver node.
+            endTime (float): time to stop searching for new patches (s)
+            prefix (tuple): leading orbits, start times, and node counts of
+                a previous propagation to continue from, as returned by
+                get_reusable_patches
+        
+        Returns:
+            the list of orbit patches, the list of their start times, and
+            the number of maneuver nodes applied by the end of each patch
+        """
+        
+        nodes = self.get_nodes()
+        nodeBurns = [node[0:3] for node in nodes]
+        nodeTimes = [node[3] for node in nodes]
+        
+        # set starting orbit and time
+        if prefix is None:
+            orbits = [self.orb]
+            times = [self.get_start_time(startTime)]
+            nodeCounts = [0]
+        else:
+            orbits = list(prefix[0])
+            times = list(prefix[1])
+            nodeCounts = list(prefix[2])
+        
+        # propagate orbit and apply maneuver nodes
+        nodeIdx = nodeCounts[-1]
+        stopSearch = False
+        while not stopSearch:
+            t = times[-1]
+            nextOrb, time = orbits[-1].propagate(t+0.1)
+            
+            # try future revolutions if no new escape/encounter in first rev
+            if nextOrb is None and orbits[-1].ecc<1:
+                for ii in range(numRevs):
+                    t = t + orbits[-1].get_period()
+                    nextOrb, time = orbits[-1].propagate(t+0.1)
+                    if not nextOrb is None:
+                        break
+            
+            # if no escape/encounter, apply next maneuver node
+            if nextOrb is None:
+                if nodeIdx < len(nodeTimes):
+                    time = nodeTimes[nodeIdx]
+                    pos, vel = orbits[-1].get_state_vector(time)
+                    burn = burn_components_to_absolute(nodeBurns[nodeIdx][0],
+                                                       nodeBurns[nodeIdx][1],
+                                                       nodeBurns[nodeIdx][2],
+                                                       pos, vel)
+                    nextOrb = Orbit.from_state_vector(pos, vel+burn, time,  \
+                                                      orbits[-1].prim);
+                    orbits.append(nextOrb)
+                    times.append(time)
+                    nodeIdx = nodeIdx+1
+                    nodeCounts.append(nodeIdx)
+            
+            # otherwise, check if a maneuver happens before escape/encounter
+            else:
+                t = time
+                if nodeIdx < len(nodeTimes):
+                    if t > nodeTimes[nodeIdx]:
+                        time = nodeTimes[nodeIdx]
+                        pos, vel = orbits[-1].get_state_vector(time)
+                        burn = burn_components_to_absolute(nodeBurns[nodeIdx][0],
+                                                           nodeBurns[nodeIdx][1],
+                                                           nodeBurns[nodeIdx][2],
+                                                           pos, vel)
+                        nextOrb = Orbit.from_state_vector(pos, vel+burn, time,  \
+                                                          orbits[-1].prim);
+                        orbits.append(nextOrb)
+                        times.append(time)
+                        nodeIdx = nodeIdx+1
+                        nodeCounts.append(nodeIdx)
+                    else:
+                        orbits.append(nextOrb)
+                        times.append(time)
+                        nodeCounts.append(nodeIdx)
+                else:
+                    orbits.append(nextOrb)
+                    times.append(time)
+                    nodeCounts.append(nodeIdx)
+            
+            if not endTime is None:
+                if t > endTime:
+                    stopSearch = True
+            
+            # end search if no maneuvers left and no escape/encounter found
+            if (nextOrb is None and nodeIdx >= len(nodeTimes)):
+                stopSearch = True
+        
+        return orbits, times, nodeCounts
+    
+    def get_reusable_patches(self, chain, startTime = None):
+        """Finds the leading patches of a previous propagation that aren't
+        affected by changes to the craft's maneuver nodes.
+        
+        The patches before the first changed node are kept, as are
+        escapes and encounters after it that still happen before the changed
+        node's new time.
+        
+        Args:
+            chain (dict): nodes, orbits, times, and node counts of a previous
+                propagation from the same starting orbit with the same
+                settings
+            startTime (float): start time used for the propagation (s)
+        
+        Returns:
+            the reusable orbits, times, and node counts, or None if no
+            patches can be reused, and whether the whole chain is unchanged
+        """
+        
+        oldNodes = [list(node) for node in chain['nodes']]
+        nodes = [list(node) for node in self.get_nodes()]
+        orbits = chain['orbits']
+        times = chain['times']
+        nodeCounts = chain['nodeCounts']
+        
+        if not self.get_start_time(startTime) == times[0]:
+            return None, False
+        if nodes == oldNodes:
+            return (orbits, times, nodeCounts), True
+        
+        # index of the first changed node
+        numSame = 0
+        while numSame < min(len(nodes), len(oldNodes)) and                  \
+              nodes[numSame] == oldNodes[numSame]:
+            numSame = numSame+1
+        
+        if numSame < len(nodes):
+            newNodeTime = nodes[numSame][3]
+        else:
+            newNodeTime = None
+        
+        # the last patch is never reused, so the search always continues
+        numReused = 0
+        for ii in range(len(orbits)-1):
+            if nodeCounts[ii] > numSame:
+                break
+            fromEncounter = ii > 0 and nodeCounts[ii] == nodeCounts[ii-1]
+            if nodeCounts[ii] == numSame and fromEncounter and               \
+               not newNodeTime is None and times[ii] > newNodeTime:
+                break
+            numReused = ii+1
+        
+        if numReused == 0:
+            return None, False
+        return (orbits[:numReused], times[:numReused],
+                nodeCounts[:numReused]), False
+
+def get_craft_from_spec(spec, system):
+    """Returns a Craft with the starting orbit and maneuver nodes of a craft
+    specification, using defaults for any empty inputs."""
+    
+    # prepare start body
+    sBody = [x for x in system if x.name == spec['prim']][0]
+    
+    # prepare start and end orbit parameters
+    startA = spec['a']
+    if startA is None:
+        startA = sBody.eqr + 100000
+    startEcc, startInc, startArgP, startLAN, startMo, startEpoch =          \
+        [0 if val is None else val for val in
+         [spec['ecc'], spec['inc'], spec['argp'], spec['lan'],
+          spec['mo'], spec['epoch']]]
+    
+    sOrb = Orbit(startA, startEcc, startInc*math.pi/180, startArgP*math.pi/180,
+                 startLAN*math.pi/180, startMo, startEpoch, sBody)
+    
+    return Craft(spec['name'], sOrb, [list(node) for node in spec['nodes']])
+
+def timed_propagate(craft, numRevs = 0, startTime = None, endTime = None,
+                    prefix = None):
+    """Propagates a craft and returns its orbits, times, node counts, and the
+    elapsed time of the propagation (s)."""
+    
+    clock = perf_counter()
+    orbits, times, nodeCounts = craft.propagate(numRevs, startTime, endTime,
+                                                prefix)
+    return orbits, times, nodeCounts, perf_counter() - clock
+
+#%% propagation in worker processes
+
+# encoded preset systems and decoded systems of a worker process
+worker_encoded_systems = dict()
+worker_systems = dict()
+MAX_WORKER_SYSTEMS = 4
+
+def init_propagation_worker(encodedSystems):
+    """Keeps the encoded preset systems in a propagation worker process, so
+    they don't need to be sent with each craft."""
+    worker_encoded_systems.update(encodedSystems)
+
+def get_worker_system(systemSource):
+    """Returns a worker process's copy of a system, decoding and scaling it
+    the first time the worker propagates a craft in it.
+    
+    Args:
+        systemSource (tuple): the system's key, the key of its encoded
+            preset or uploaded system, its resize and rescale factors, and
+            the encoded system if it isn't a preset (or None)
+    """
+    
+    systemKey, encodedKey, resizeFactor, rescaleFactor, encodedSystem =     \
+        systemSource
+    if not systemKey in worker_systems:
+        if encodedSystem is None:
+            encodedSystem = worker_encoded_systems[encodedKey]
+        system = jsonpickle.decode(encodedSystem)
+        for body in system:
+            body.resize(resizeFactor)
+            body.rescale(rescaleFactor)
+        if len(worker_systems) >= MAX_WORKER_SYSTEMS:
+            worker_systems.clear()
+        worker_systems[systemKey] = system
+    return worker_systems[systemKey]
+
+def get_orbit_elements(orb):
+    """Returns the orbital elements of an orbit, with its primary's name."""
+    return (orb.a, orb.ecc, orb.inc, orb.argp, orb.lan, orb.mo, orb.epoch,
+            orb.prim.name)
+
+def get_orbit_from_elements(elements, bodies):
+    """Returns an orbit from its elements, around the named body in a
+    dictionary of bodies."""
+    return Orbit(*elements[:-1], bodies[elements[-1]])
+
+def propagate_spec_in_worker(systemSource, spec, numRevs, startTime,
+                             endTime, prefix):
+    """Propagates the craft of a craft specification in a worker process.
+    
+    Orbits are passed to and from the worker as orbital elements, so the
+    bodies of the system aren't copied between processes.
+    """
+    
+    system = get_worker_system(systemSource)
+    bodies = {bd.name: bd for bd in system}
+    if not prefix is None:
+        prefix = ([get_orbit_from_elements(elements, bodies)
+                   for elements in prefix[0]],) + tuple(prefix[1:])
+    orbits, times, nodeCounts, elapsed = timed_propagate(
+        get_craft_from_spec(spec, system), numRevs, startTime, endTime, prefix)
+    return [get_orbit_elements(orb) for orb in orbits], times, nodeCounts,  \
+        elapsed
+
+def propagate_crafts(craftSpecs, system, numRevs = 0, startTime = None,
+                     endTime = None, executor = None, systemSource = None,
+                     prefixes = None):
+    """Propagates the trajectories of several crafts.
+    
+    The crafts are independent of each other, so if an executor (such as a
+    ProcessPoolExecutor started with init_propagation_worker) is given, they
+    are propagated concurrently. Only the craft specifications and the
+    system's source are sent to the workers, which keep their own decoded
+    copies of the system.
+    
+    Args:
+        craftSpecs (list): specifications of the crafts to propagate
+        system (list): the bodies of the crafts' system
+        numRevs, startTime, endTime: arguments of Craft.propagate
+        executor (Executor): pool to run the propagations in
+        systemSource (tuple): the system's source for the workers (see
+            get_worker_system)
+        prefixes (list): patches of a previous propagation to continue
+            from for each craft (or None)
+    
+    Returns:
+        a list with the orbits, start times, node counts, and elapsed time
+        of each craft, in the same order as the crafts
+    """
+    
+    if prefixes is None:
+        prefixes = [None]*len(craftSpecs)
+    
+    if executor is None or len(craftSpecs) < 2:
+        return [timed_propagate(get_craft_from_spec(spec, system),
+                                numRevs, startTime, endTime, prefix)        \
+                for spec, prefix in zip(craftSpecs, prefixes)]
+    
+    futures = []
+    for spec, prefix in zip(craftSpecs, prefixes):
+        if not prefix is None:
+            prefix = ([get_orbit_elements(orb) for orb in prefix[0]],) +    \
+                tuple(prefix[1:])
+        futures.append(executor.submit(propagate_spec_in_worker,
+                                       systemSource, spec, numRevs,
+                                       startTime, endTime, prefix))
+    
+    # the orbits refer to this process's copy of the system
+    bodies = {bd.name: bd for bd in system}
+    results = []
+    for future in futures:
+        elements, times, nodeCounts, elapsed = future.result()
+        results.append(([get_orbit_from_elements(orbElements, bodies)
+                         for orbElements in elements],
+                        times, nodeCounts, elapsed))
+    return results
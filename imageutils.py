@@ -1,14 +1,106 @@
 import os
+import tempfile
+import threading
+from uuid import uuid4
+from collections import OrderedDict
 from PIL import Image
 import numpy as np
 import requests
 from io import BytesIO
 
+# texture maps are read from the app's assets when they're there, and are
+# otherwise downloaded once into a cache directory
+IMAGE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'assets', 'images')
+TEXTURE_CACHE_DIRECTORY = os.environ.get('TEXTURE_CACHE_DIRECTORY',
+    os.path.join(tempfile.gettempdir(), 'kspti_textures'))
+TEXTURE_CACHE_BYTES = int(os.environ.get('TEXTURE_CACHE_BYTES', 256*2**20))
+
+# precomputed colormaps of the small texture maps (see make_texture_palettes)
+PALETTE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'assets', 'palettes')
+
+# sizes of the levels of each small texture map's pyramid, from the full map
+# down to its coarsest level
+TEXTURE_MIP_SIZES = (512, 256, 128, 64)
+
+# number of decoded texture maps kept in memory
+TEXTURE_MEMO_SIZE = int(os.environ.get('TEXTURE_MEMO_SIZE', 16))
+
+texture_memo = OrderedDict()
+texture_memo_lock = threading.Lock()
+
 def map_url(bodyName, mapType):
     mapDirURL = "https://raw.githubusercontent.com/theastrogoth/KSP-Trajectory-Illustrator/master/assets/images/"
 
     return mapDirURL + str(bodyName) + str(mapType) + '.png'
 
+def get_texture_path(bodyName, mapType):
+    """Returns the path of a local copy of a body's texture map, downloading
+    it into the texture cache if it isn't in the app's assets.
+    
+    Raises:
+        requests.RequestException: if the map has to be downloaded and can't
+    """
+    
+    filename = str(bodyName) + str(mapType) + '.png'
+    path = os.path.join(IMAGE_DIRECTORY, filename)
+    if os.path.exists(path):
+        return path
+    
+    path = os.path.join(TEXTURE_CACHE_DIRECTORY, filename)
+    if os.path.exists(path):
+        # mark the file as recently used
+        os.utime(path)
+        return path
+    
+    response = requests.get(map_url(bodyName, mapType), timeout = 10)
+    response.raise_for_status()
+    if not os.path.exists(TEXTURE_CACHE_DIRECTORY):
+        os.makedirs(TEXTURE_CACHE_DIRECTORY, exist_ok = True)
+    tmpPath = path + '.' + uuid4().hex + '.tmp'
+    with open(tmpPath, 'wb') as outfile:
+        outfile.write(response.content)
+    os.replace(tmpPath, path)
+    prune_texture_cache(TEXTURE_CACHE_BYTES)
+    return path
+
+def prune_texture_cache(maxBytes):
+    """Removes the least recently used texture maps from the cache directory
+    until its files take up at most maxBytes."""
+    
+    paths = [os.path.join(TEXTURE_CACHE_DIRECTORY, filename)
+             for filename in os.listdir(TEXTURE_CACHE_DIRECTORY)
+             if filename.endswith('.png')]
+    paths.sort(key = os.path.getmtime)
+    totalBytes = sum(os.path.getsize(path) for path in paths)
+    for path in paths[:-1]:
+        if totalBytes <= maxBytes:
+            break
+        try:
+            totalBytes = totalBytes - os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+
+def get_texture_pixels(bodyName, mapType):
+    """Returns the pixel values, width, and height of a body's texture map,
+    as get_pixel_values does. The most recently used maps are kept in
+    memory."""
+    
+    key = (bodyName, mapType)
+    with texture_memo_lock:
+        if key in texture_memo:
+            texture_memo.move_to_end(key)
+            return texture_memo[key]
+    
+    texture = get_pixel_values(get_texture_path(bodyName, mapType), False)
+    with texture_memo_lock:
+        texture_memo[key] = texture
+        while len(texture_memo) > TEXTURE_MEMO_SIZE:
+            texture_memo.popitem(last=False)
+    return texture
+
 def combine_tiles(path=None):
     
     if not path is None:
@@ -46,30 +138,125 @@ def make_small_image(path=None):
                 if width==2048 and height==1024:
                     image = image.convert('RGB')
                     newImage = image.resize((512, 512))
-                    pix = image_colormap(list(newImage.getdata()))[2]
-                    newImage.putdata(pix)
+                    pix = image_colormap(np.array(newImage).reshape(-1,3))[2]
+                    newImage = Image.fromarray(
+                        pix.reshape(512, 512, 3).astype(np.uint8))
                     newImage.save(os.path.join(path,file[:-4]+'Small.png'))
 
-def round_colors(pix, roundVal):
+def make_texture_palettes(path=None, outPath=PALETTE_DIRECTORY):
+    """Saves the palette of each small texture map, and the palette indices
+    of the pixels of each level of its pyramid (see get_mip_indices), to a
+    .npz file in outPath. The app loads these instead of computing the
+    colormaps."""
     
-    newPix = []
-    for pick in pix:
-        rgb = list(pick)
-        for jj, cl in enumerate(pick):
-            # rgb[jj] = cl - cl%roundVal + roundVal/2
-            rgb[jj] = round(roundVal * round(cl/roundVal))
-        newPix.append(tuple(rgb))
+    if not path is None:
+        os.chdir(path)
+    os.makedirs(outPath, exist_ok=True)
     
-    return newPix
+    for path, directories, files in os.walk(path):
+        for file in files:
+            if file[-9:] == 'Small.png':
+                pix, width, height = get_pixel_values(os.path.join(path, file),
+                                                      False)
+                uniqueColors, colorIdxs = unique_colors(pix)
+                colorIdxs = np.reshape(colorIdxs, (height, width))
+                if len(uniqueColors) <= 256:
+                    idxType = np.uint8
+                else:
+                    idxType = np.uint16
+                levels = dict()
+                for size in TEXTURE_MIP_SIZES:
+                    levels['indices'+str(size)] = get_mip_indices(
+                        uniqueColors, colorIdxs, size).astype(idxType)
+                np.savez_compressed(
+                    os.path.join(outPath, file[:-4]+'Palette.npz'),
+                    colors = uniqueColors.astype(np.uint8), **levels)
+
+def get_mip_indices(uniqueColors, colorIdxs, size):
+    """Returns the palette indices of a level of a texture map's pyramid.
+    The map's colors are averaged over blocks of pixels, down to size by
+    size pixels, and each block gets the palette color nearest its average.
+    
+    Args:
+        uniqueColors (ndarray): the map's palette, one RGB color per row
+        colorIdxs (ndarray): the palette index of each of the map's pixels,
+            with one row per row of pixels
+        size (int): the width and height of the level, in pixels, which
+            can't be larger than the map's
+    
+    Returns:
+        an array of palette indices with one row per row of pixels
+    """
+    
+    height, width = np.shape(colorIdxs)
+    if (height == size) and (width == size):
+        return colorIdxs
+    
+    uniqueColors = np.asarray(uniqueColors, dtype=float)
+    blockHeight = height // size
+    blockWidth = width // size
+    blocks = uniqueColors[colorIdxs[:blockHeight*size, :blockWidth*size]]
+    blocks = np.reshape(blocks, (size, blockHeight, size, blockWidth, 3))
+    blocks = np.reshape(np.mean(blocks, axis=(1,3)), (-1,3))
+    
+    # squared distance from each block's average to each palette color
+    dists = np.sum(blocks**2, axis=1)[:,np.newaxis]                         \
+            - 2 * blocks @ np.transpose(uniqueColors)                       \
+            + np.sum(uniqueColors**2, axis=1)[np.newaxis,:]
+    return np.reshape(np.argmin(dists, axis=1), (size, size))
+
+def get_texture_colormap(bodyName, mapType, size=TEXTURE_MIP_SIZES[0]):
+    """Returns the colorscale of a body's texture map and the value of each
+    of its pixels on the colorscale, as image_colormap does for unrounded
+    colors, for a level of the map's pyramid (see get_mip_indices).
+    Precomputed palettes are used if available, and the most recently used
+    colormaps are kept in memory."""
+    
+    key = (bodyName, mapType, 'colormap', size)
+    with texture_memo_lock:
+        if key in texture_memo:
+            texture_memo.move_to_end(key)
+            return texture_memo[key]
+    
+    palettePath = os.path.join(PALETTE_DIRECTORY,
+                               str(bodyName) + str(mapType) + 'Palette.npz')
+    colorIdxs = None
+    if os.path.exists(palettePath):
+        with np.load(palettePath) as palette:
+            uniqueColors = palette['colors']
+            if 'indices'+str(size) in palette:
+                colorIdxs = palette['indices'+str(size)]
+    if colorIdxs is None:
+        pix, width, height = get_texture_pixels(bodyName, mapType)
+        uniqueColors, colorIdxs = unique_colors(pix)
+        colorIdxs = get_mip_indices(uniqueColors,
+                                    np.reshape(colorIdxs, (height, width)),
+                                    size)
+    colormap = palette_colormap(uniqueColors, colorIdxs)
+    
+    with texture_memo_lock:
+        texture_memo[key] = colormap
+        while len(texture_memo) > TEXTURE_MEMO_SIZE:
+            texture_memo.popitem(last=False)
+    return colormap
+
+def round_colors(pix, roundVal):
+    """Rounds each channel of an array of colors to the nearest multiple of
+    roundVal."""
+    
+    # cl - cl%roundVal + roundVal/2
+    return np.round(roundVal * np.round(np.asarray(pix)/roundVal)).astype(int)
 
 def get_pixel_values(imagePath, url=True):
+    """Returns the RGB values of an image's pixels as an array with one row
+    per pixel, and the image's width and height."""
     if url:
         response = requests.get(imagePath)
         image = Image.open(BytesIO(response.content))
     else:
         image = Image.open(imagePath)
     image = image.convert('RGB')
-    pix = list(image.getdata())
+    pix = np.array(image).reshape(-1,3)
     width, height = (image.size)
     return pix, width, height
 
@@ -82,15 +269,41 @@ def pixel_to_grayscale_value(r=None,g=None,b=None, tup=None):
     
     return (r+b+g)/3
 
+def unique_colors(pix):
+    """Returns the unique colors in an array of RGB values (sorted as
+    np.unique sorts rows), and the index of each pixel's color."""
+    
+    # pack each color into one integer, which sorts the same way as the rows
+    pix = np.asarray(pix).astype(np.int64)
+    codes = (pix[:,0] << 16) | (pix[:,1] << 8) | pix[:,2]
+    uniqueCodes, colorIdxs = np.unique(codes, return_inverse=True)
+    uniqueColors = np.stack((uniqueCodes >> 16,
+                             (uniqueCodes >> 8) & 255,
+                             uniqueCodes & 255), axis=1)
+    return uniqueColors, colorIdxs
+
 def image_colormap(pix, roundNum=85, rounded=False):
+    """Reduces the colors of an image to a colorscale that plotly can use.
+    
+    Args:
+        pix (array): RGB values, one row per pixel
+        roundNum (int): starting number of levels per color channel. It's
+            reduced until there are at most 100 unique colors.
+        rounded (bool): if true, the colors are used without rounding
     
+    Returns:
+        the colorscale, the value of each pixel on the colorscale, and the
+        rounded RGB values of the pixels
+    """
+    
+    pix = np.asarray(pix).reshape(-1,3)
     if not rounded:
         numUnique = 999
         # plotly seems to fail if the colormap has >~100 intervals
         while numUnique > 100:
             newPix = round_colors(pix, 255/roundNum)
             
-            uniqueColors = np.unique(newPix, axis=0)
+            uniqueColors, colorIdxs = unique_colors(newPix)
             numUnique = len(uniqueColors)
             if roundNum <= 5:
                 roundNum = roundNum-1
@@ -98,22 +311,28 @@ def image_colormap(pix, roundNum=85, rounded=False):
                 roundNum = roundNum - round(roundNum/10)
     else:
         newPix = pix
-        uniqueColors = np.unique(pix, axis=0)
+        uniqueColors, colorIdxs = unique_colors(pix)
         numUnique = len(uniqueColors)
     
+    colorMap, colorVals = palette_colormap(uniqueColors, colorIdxs)
+    return colorMap, colorVals, newPix
+
+def palette_colormap(uniqueColors, colorIdxs):
+    """Returns a colorscale with an interval for each color of a palette,
+    and the value of each pixel (given by its palette index) on it."""
+    
+    numUnique = len(uniqueColors)
     breaks = np.linspace(0,1,numUnique+1)
     interval = breaks[1]
-    mapVal = 0
     
-    colorMap = [[0, 'rgb'+str(tuple(uniqueColors[0]))]]
-    mapDict = {}
-    mapDict[tuple(uniqueColors[0])] = interval/2
+    colorNames = ['rgb({:d}, {:d}, {:d})'.format(*color)
+                  for color in np.asarray(uniqueColors).tolist()]
+    colorMap = [[0, colorNames[0]]]
     for ii in range(numUnique):
-        colorMap.append([mapVal, 'rgb'+str(tuple(uniqueColors[ii]))])
-        mapDict[tuple(uniqueColors[ii])] = mapVal+interval/2
-        mapVal = mapVal + interval
-        if ii == numUnique-1:
-            mapVal = 1
-        colorMap.append([mapVal, 'rgb'+str(tuple(uniqueColors[ii]))])
-        
-    return colorMap, mapDict, newPix
+        colorMap.append([breaks[ii], colorNames[ii]])
+        colorMap.append([breaks[ii+1], colorNames[ii]])
+    
+    # each pixel's value is the middle of its color's interval
+    colorVals = breaks[np.reshape(colorIdxs, -1)] + interval/2
+    
+    return colorMap, colorVals
@@ -0,0 +1,192 @@
+"""Background execution of long computations for the Dash app."""
+import json
+import time
+import threading
+import traceback
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+
+class JobQueue:
+    """Runs long computations in background threads.
+    
+    Callbacks submit a job and immediately return its id, so they don't hold
+    a server thread for the whole computation. Jobs wait in a queue until
+    one of the workers is free, and their results are put in the session
+    store under the job id.
+    
+    If the store has a backend, each job's status is also written to it, so
+    that a job can be polled and collected from any server process.
+    
+    Finished jobs that aren't collected within maxAge seconds (for example,
+    because their browser tab was closed) are forgotten, and their results
+    and shared statuses expire from the backend after that time.
+    
+    Attributes:
+        store (SessionStore): store that receives the jobs' results
+        executor (ThreadPoolExecutor): pool of worker threads
+        maxAge (float): time (s) a finished job waits to be collected
+        jobs (dict): status, submit, start, and finish times, and error
+            message of each job submitted in this process that hasn't been
+            collected
+    
+    """
+    
+    def __init__(self, store, maxWorkers = 2, maxAge = 600):
+        self.store = store
+        self.executor = ThreadPoolExecutor(maxWorkers)
+        self.maxAge = maxAge
+        self.jobs = dict()
+        self.lock = threading.Lock()
+    
+    def submit(self, func, *args):
+        """Queues func(*args) to run in the background.
+        
+        Returns:
+            the job id, which is also the session store key of the result
+        """
+        
+        self.expire()
+        
+        jobId = 'job-' + uuid4().hex
+        with self.lock:
+            self.jobs[jobId] = dict(status = 'queued',
+                                    submitTime = time.time(),
+                                    startTime = None,
+                                    finishTime = None,
+                                    error = None)
+        self.share_status(jobId)
+        self.executor.submit(self.run, jobId, func, *args)
+        return jobId
+    
+    def share_status(self, jobId):
+        """Writes a job's status to the store's backend, if it has one."""
+        
+        if self.store.backend is None:
+            return
+        with self.lock:
+            job = self.jobs.get(jobId)
+            if job is None:
+                return
+            job = dict(job)
+        
+        # unfinished jobs keep their status for as long as stored objects
+        if job['finishTime'] is None:
+            ttl = self.store.ttl
+        else:
+            ttl = self.maxAge
+        self.store.backend.set(jobId + '-status',
+                               json.dumps(job).encode('utf-8'), ex = ttl)
+    
+    def get_shared_status(self, jobId):
+        """Returns a job's status from the store's backend, or None if it
+        isn't there."""
+        
+        if self.store.backend is None:
+            return None
+        value = self.store.backend.get(jobId + '-status')
+        if value is None:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+    
+    def run(self, jobId, func, *args):
+        with self.lock:
+            # jobs forgotten while waiting in the queue are skipped
+            if not jobId in self.jobs:
+                return
+            self.jobs[jobId]['status'] = 'running'
+            self.jobs[jobId]['startTime'] = time.time()
+        self.share_status(jobId)
+        try:
+            result = func(*args)
+            status = 'done'
+            error = None
+        except Exception as e:
+            traceback.print_exc()
+            status = 'failed'
+            error = str(e)
+        
+        with self.lock:
+            forgotten = not jobId in self.jobs
+            if not forgotten:
+                self.jobs[jobId]['status'] = status
+                self.jobs[jobId]['error'] = error
+                self.jobs[jobId]['finishTime'] = time.time()
+        if forgotten:
+            return
+        
+        # with a backend, the result may be collected by another server
+        # process, so this one doesn't keep it in memory
+        if status == 'done':
+            self.store.put(result, jobId, cache = False, ttl = self.maxAge)
+        self.share_status(jobId)
+        if not self.store.backend is None:
+            with self.lock:
+                self.jobs.pop(jobId, None)
+    
+    def get_status(self, jobId):
+        """Returns the job's status ('queued', 'running', 'done', 'failed',
+        or 'unknown'), and a short message describing it."""
+        
+        with self.lock:
+            job = self.jobs.get(jobId)
+            if not job is None:
+                job = dict(job)
+        
+        if job is None:
+            # the job may have been submitted to another server process
+            job = self.get_shared_status(jobId)
+            if job is None:
+                return 'unknown', ''
+            if job['status'] == 'queued':
+                return 'queued', 'Waiting in queue'
+        
+        if job['status'] == 'queued':
+            with self.lock:
+                position = len([jb for jb in self.jobs.values()
+                                if jb['status'] == 'queued' and
+                                jb['submitTime'] <= job['submitTime']])
+            return 'queued', 'Waiting in queue (position {})'.format(position)
+        elif job['status'] == 'running':
+            elapsed = time.time() - job['startTime']
+            return 'running', 'Calculating... ({:.0f} s)'.format(elapsed)
+        elif job['status'] == 'failed':
+            return 'failed', 'Calculation failed: ' + job['error']
+        else:
+            return 'done', ''
+    
+    def collect(self, jobId):
+        """Returns the result of a finished job, and removes it and the
+        job's status from the store.
+        
+        Raises:
+            KeyError: if the job's result isn't in the store
+        """
+        
+        result = self.store.get(jobId)
+        self.forget(jobId)
+        return result
+    
+    def forget(self, jobId):
+        """Forgets a job and removes its result, if there is one. If the job
+        was submitted in this process and is still queued, it won't run, and
+        if it's running, its result won't be stored."""
+        with self.lock:
+            self.jobs.pop(jobId, None)
+        self.store.delete(jobId)
+        if not self.store.backend is None:
+            self.store.backend.delete(jobId + '-status')
+    
+    def expire(self):
+        """Forgets the jobs of this process that finished more than maxAge
+        seconds ago without being collected."""
+        
+        oldest = time.time() - self.maxAge
+        with self.lock:
+            jobIds = [jobId for jobId, job in self.jobs.items()
+                      if not job['finishTime'] is None and
+                      job['finishTime'] < oldest]
+        for jobId in jobIds:
+            self.forget(jobId)
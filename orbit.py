@@ -40,9 +40,14 @@ class Orbit:
         X (array): first basis vector
         Y (array): second basis vector
         Z (array): third basis vector (normal to orbital plane)
+        frozen (bool): whether the orbital elements can no longer be changed
         
     """
     
+    # elements that can't be changed after the orbit is frozen
+    ELEMENTS = ('a', 'ecc', 'inc', 'argp', 'lan', 'mo', 'epoch', 'prim')
+    frozen = False
+    
     def __init__(self, a=None, ecc=None, inc=None, 
                  argp=None, lan=None, mo=None, epoch=0, prim=None):
         
@@ -63,6 +68,24 @@ class Orbit:
         self.mo = mo
         self.epoch = epoch
     
+    def __setattr__(self, name, value):
+        if self.frozen and (name in self.ELEMENTS or name == 'frozen'):
+            raise AttributeError(
+                "can't change " + name + ' of a frozen orbit')
+        object.__setattr__(self, name, value)
+    
+    def freeze(self):
+        """Prevents changes to the orbit's elements, for orbits that are
+        shared. Derived values like the period are still cached."""
+        self.frozen = True
+    
+    def __copy__(self):
+        # copies of frozen orbits can be changed
+        orb = object.__new__(type(self))
+        orb.__dict__.update(self.__dict__)
+        orb.__dict__.pop('frozen', None)
+        return orb
+    
     
     @classmethod
     def from_state_vector(cls,pos,vel,t,primaryBody):
@@ -646,22 +669,102 @@ class Orbit:
         Returns:
             An array of position vectors at the specified times
         """
-        # initialize positions array and evenly sample times
-        positions = np.empty((0,3))
-        velocities = np.empty((0,3))
+        # evenly sample times
         if times is None:
             times = np.linspace(startTime, endTime, num)
         
-        # get the position vector for each time and add it to array
-        for t in times:
-            pos, vel = self.get_state_vector(t)
-            # parent = self.prim
-            # while not parent.orb.prim == parent:
-            #     pos = parent.orb.from_orbit_to_primary_bases(pos)
-            #     parent = parent.orb.prim
-            positions = np.append(positions, [pos], axis=0)
-            velocities = np.append(velocities, [vel], axis=0)
-        return positions, velocities
+        return self.get_state_vectors(times)
+    
+    
+    def get_state_vectors(self, times):
+        """Returns the position and velocity vectors of the orbit at an array
+        of times, solving Kepler's equation for all of them at once.
+        
+        Args:
+            times (array): times (seconds)
+        
+        Returns:
+            Arrays of the position (m) and velocity (m/s) vectors, with one
+            row for each time
+        """
+        
+        times = np.array(times, dtype = float).flatten()
+        
+        # If the orbit is for the system root, make it stationary at origin
+        if self.a is None:
+            return np.zeros((len(times),3)), np.zeros((len(times),3))
+        
+        # Get mean anomalies, as in get_mean_anomaly
+        meanAnoms = self.mo + (times-self.epoch) /                          \
+                    (self.get_period()/(2*math.pi))
+        if self.ecc < 1:
+            meanAnoms = meanAnoms -                                         \
+                2*math.pi*np.floor(meanAnoms/(2*math.pi))
+        meanAnoms[times == self.epoch] = self.mo
+        
+        # Parabolic case
+        if self.ecc == 1:
+            raise Exception('parabolic case (e=1) not implemented')
+        
+        # Solve Kepler's equation with Newton's method, as in solve_Keplers,
+        # and get the true anomalies
+        tol = 1E-12
+        maxIt = 1000
+        ecc = self.ecc
+        if ecc < 1:
+            if ecc < 0.08:
+                anoms = np.copy(meanAnoms)
+            else:
+                anoms = np.full(len(meanAnoms), math.pi)
+            active = np.ones(len(anoms), dtype = bool)
+            for it in range(maxIt):
+                if not active.any():
+                    break
+                prev = anoms[active]
+                anoms[active] = prev - (prev - ecc*np.sin(prev) -           \
+                    meanAnoms[active]) / (1-ecc*np.cos(prev))
+                active[active] = np.abs(anoms[active]-prev) > tol
+            nus = 2*np.arctan2(math.sqrt(1+ecc)*np.sin(anoms/2),            \
+                               math.sqrt(1-ecc)*np.cos(anoms/2))
+        else:
+            anoms = np.clip(meanAnoms, -4*math.pi, 4*math.pi)
+            active = np.ones(len(anoms), dtype = bool)
+            with np.errstate(over = 'ignore', invalid = 'ignore'):
+                for it in range(maxIt):
+                    if not active.any():
+                        break
+                    prev = anoms[active]
+                    new = prev + (meanAnoms[active] - ecc*np.sinh(prev) +   \
+                        prev) / (ecc*np.cosh(prev) - 1)
+                    new[~np.isfinite(new)] = math.pi
+                    anoms[active] = new
+                    active[active] = np.abs(new-prev) > tol
+            nus = np.arctan2(-self.a*math.sqrt(ecc**2-1)*np.sinh(anoms),    \
+                             -self.a*(ecc-np.cosh(anoms)))
+        
+        # Get positions and velocities in orbital frame, as in
+        # get_state_vector
+        rMags = self.a*(1-ecc**2) / (1+ecc*np.cos(nus))
+        o = rMags * np.array([np.cos(nus), np.sin(nus), np.zeros(len(nus))])
+        phis = np.arctan(ecc*np.sin(nus) / (1+ecc*np.cos(nus)))
+        drdtMags = np.sqrt(self.prim.mu*(2/rMags - 1/self.a))
+        dodt = drdtMags * np.array([np.cos(nus+math.pi/2 - phis),
+                                    np.sin(nus+math.pi/2 - phis),
+                                    np.zeros(len(nus))])
+        
+        # Rotate to primary reference frame
+        R1 = np.array([[math.cos(-self.lan), -math.sin(-self.lan), 0],      \
+                       [math.sin(-self.lan), math.cos(-self.lan), 0],       \
+                       [0, 0, 1]])
+        R2 = np.array([[1, 0, 0],                                           \
+                       [0, math.cos(-self.inc), -math.sin(-self.inc)],      \
+                       [0, math.sin(-self.inc), math.cos(-self.inc)]])
+        R3 = np.array([[math.cos(-self.argp), -math.sin(-self.argp), 0],    \
+                       [math.sin(-self.argp), math.cos(-self.argp), 0],
+                       [0, 0, 1]])
+        R = np.transpose(np.matmul(R3, np.matmul(R2,R1)))
+        
+        return np.transpose(np.matmul(R,o)), np.transpose(np.matmul(R,dodt))
     
     
     def get_angle_in_orbital_plane(self, t, vec):
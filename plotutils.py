@@ -1,6 +1,7 @@
 # Porkchop and 3D orbit plotting utility functions
 
 import plotly.graph_objects as go
+from plotly.colors import unlabel_rgb
 import jsonpickle
 import math
 import numpy as np
@@ -9,7 +10,8 @@ from orbit import Orbit
 from body import Body
 from transfer import Transfer
 from prktable import PorkchopTable
-from imageutils import image_colormap, map_url, get_pixel_values
+from imageutils import image_colormap, get_texture_colormap,              \
+                       TEXTURE_MIP_SIZES
 
 #%% misc functions
 
@@ -201,14 +203,108 @@ def add_marker(figure, x, y, symbol = 'x', color = 'black', size = 12):
 
 #%% trajectory plot functions
 
+# allowed distance between a drawn orbit and the true orbit, as a fraction of
+# the plot's axis limit
+ORBIT_TOLERANCE = 2E-4
+
+# number of points each orbit's sampling starts from, before it's refined
+ORBIT_SEED_POINTS = 64
+
+# objects smaller than these fractions of the axis limit are drawn with less
+# detail, or only as markers (see get_detail_level)
+DETAIL_REDUCED_RATIO = 0.02
+DETAIL_MARKER_RATIO = 0.002
+
+# number of points each orbit's sampling starts from at reduced detail
+ORBIT_REDUCED_SEED_POINTS = 16
+
+# rings of latitude in the meshes of bodies and spheres of influence, at full
+# and reduced detail (see get_sphere_mesh)
+SPHERE_RESOLUTION = 8
+SPHERE_REDUCED_RESOLUTION = 4
+
+# width in pixels that a textured surface's map needs for a body whose radius
+# is as large as the plot's axis limit (see get_texture_size), which leaves
+# detail to spare for zooming in
+TEXTURE_DETAIL_SCALE = 8192
+
+# unit sphere meshes that have been built, by resolution
+sphere_meshes = dict()
+
 def fade_color(color, div = 2):
     """Divides each element of the tuple by the specified number."""
     
     return tuple(math.floor(c/div) for c in color)
 
+def cluster_anomalies(start, end, n, ks):
+    """Returns mean anomalies between start and end, spaced as the cosine of
+    evenly spaced angles so that they cluster toward both ends. The samples
+    ks are indices (possibly fractional) out of n."""
+    
+    return 0.5*(start+end) + 0.5*(end-start) * np.cos((n-ks)/n*math.pi)
+
+def refine_orbit_samples(orb, times, tol, maxPts = 2001):
+    """Adds samples between neighboring times of an orbit until the orbit
+    strays from the straight line between them by less than a tolerance.
+    
+    Each round, the orbit's position halfway (in time) between neighbors is
+    compared to the midpoint of the line between them. If they're too far
+    apart, the halfway sample is kept and both halves are checked again.
+    
+    Args:
+        orb (Orbit): the orbit to be sampled
+        times (array): initial sample times, in increasing order (s)
+        tol (float): allowed distance between the orbit and the lines (m)
+        maxPts (int): maximum number of samples
+    
+    Returns:
+        arrays of the sample times, and the position and velocity vectors
+        at those times (one row per time)
+    """
+    
+    times = np.array(times, dtype = float)
+    pos, vel = orb.get_state_vectors(times)
+    refine = np.ones(len(times)-1, dtype = bool)
+    
+    while refine.any() and (len(times) < maxPts):
+        idxs = np.nonzero(refine)[0][:maxPts-len(times)]
+        midTimes = (times[idxs] + times[idxs+1])/2
+        midPos, midVel = orb.get_state_vectors(midTimes)
+        err = norm(midPos - (pos[idxs]+pos[idxs+1])/2, axis = 1)
+        
+        # keep halfway samples that are too far from the line
+        bad = err > tol
+        idxs = idxs[bad]
+        times = np.insert(times, idxs+1, midTimes[bad])
+        pos = np.insert(pos, idxs+1, midPos[bad], axis = 0)
+        vel = np.insert(vel, idxs+1, midVel[bad], axis = 0)
+        
+        # check both halves of the split lines again
+        newIdxs = idxs + 1 + np.arange(len(idxs))
+        refine = np.zeros(len(times)-1, dtype = bool)
+        refine[newIdxs-1] = True
+        refine[newIdxs] = True
+    
+    return times, pos, vel
+
 def add_orbit(figure, orb, startTime, endTime=None, numPts=201,
               dateFormat=None, apses=False, nodes=False, fullPeriod=True,
-              color=(255,255,255), name='', style='solid', fade=True,):
+              color=(255,255,255), name='', style='solid', fade=True,
+              tol=None, maxPts=2001, batch=False):
+    """Adds a trace of an orbit between two times.
+    
+    The orbit is sampled with about numPts points, clustered toward the
+    apses. If tol is given, those are only a starting point: more samples
+    are added (up to maxPts) until the drawn line is within tol (m) of the
+    orbit everywhere, so that simple orbits use few points.
+    
+    If batch is true, the orbit's elements are put in each point's hover
+    data rather than in the hover template, so that all orbits share a
+    template and can be merged into one trace by batch_traces.
+    
+    Returns:
+        the number of points in the trace
+    """
     
     if fade:
         fadedColor = fade_color(color,3)
@@ -244,21 +340,12 @@ def add_orbit(figure, orb, startTime, endTime=None, numPts=201,
         n = math.ceil(math.pi/(mEnd-mStart)*numPts)
         kStart = n*math.acos((a+b-2*mStart)/(b-a))/math.pi
         kEnd =   n*math.acos((c+d-2*mEnd)/(d-c))/math.pi
-        ks1 = [[kStart]]
-        ks1.append([*range(math.ceil(kStart), n)])
-        ks1 = [k for sublist in ks1 for k in sublist]
-        meanAnoms1 =                                                        \
-            [0.5*(a+b) + 0.5*(b-a) *math.cos((n-k)/n*math.pi) for k in ks1];
-        ks2 = [*range(0,n)]
-        meanAnoms2 =                                                        \
-            [0.5*(b+c) + 0.5*(c-b) *math.cos((n-k)/n*math.pi) for k in ks2];
-        ks3 = [*range(0,math.ceil(kEnd))]
-        ks3.append(kEnd)
-        meanAnoms3 =                                                        \
-            [0.5*(c+d) + 0.5*(d-c) *math.cos((n-k)/n*math.pi) for k in ks3];
-        meanAnoms = np.append(meanAnoms1, meanAnoms2)
-        meanAnoms = np.append(meanAnoms, meanAnoms3)
-        times = startTime + period/(2*math.pi) * (meanAnoms - mStart)
+        meanAnoms = np.concatenate((                                        \
+            cluster_anomalies(a, b, n, np.append(kStart,                    \
+                                        np.arange(math.ceil(kStart), n))),  \
+            cluster_anomalies(b, c, n, np.arange(0, n)),                    \
+            cluster_anomalies(c, d, n, np.append(                           \
+                                        np.arange(0, math.ceil(kEnd)), kEnd))))
     # orbit crosses one apo/peri-apsis
     elif mEnd > b:
         if orb.ecc < 1:
@@ -271,17 +358,11 @@ def add_orbit(figure, orb, startTime, endTime=None, numPts=201,
             n2 = math.ceil(abs(mEnd/(mEnd-mStart))*numPts)
         kStart = n1*math.acos((a+b-2*mStart)/(b-a))/math.pi
         kEnd =   n2*math.acos((b+c-2*mEnd)/(c-b))/math.pi
-        ks1 = [[kStart]]
-        ks1.append([*range(math.ceil(kStart), n1)])
-        ks1 = [k for sublist in ks1 for k in sublist]
-        meanAnoms1 =                                                        \
-            [0.5*(a+b) + 0.5*(b-a) *math.cos((n1-k)/n1*math.pi) for k in ks1];
-        ks2 = [*range(0,math.ceil(kEnd))]
-        ks2.append(kEnd)
-        meanAnoms2 =                                                        \
-            [0.5*(b+c) + 0.5*(c-b) *math.cos((n2-k)/n2*math.pi) for k in ks2];
-        meanAnoms = np.append(meanAnoms1, meanAnoms2)
-        times = startTime + period/(2*math.pi) * (meanAnoms - mStart)
+        meanAnoms = np.concatenate((                                        \
+            cluster_anomalies(a, b, n1, np.append(kStart,                   \
+                                        np.arange(math.ceil(kStart), n1))), \
+            cluster_anomalies(b, c, n2, np.append(                          \
+                                        np.arange(0, math.ceil(kEnd)), kEnd))))
     # orbit crosses no apo/peri-apses
     else:
         if orb.ecc < 1:
@@ -290,22 +371,20 @@ def add_orbit(figure, orb, startTime, endTime=None, numPts=201,
             n = numPts
         kStart = n*math.acos((a+b-2*mStart)/(b-a))/math.pi
         kEnd = n*math.acos((a+b-2*mEnd)/(b-a))/math.pi
-        ks = [[kStart]]
-        ks.append([*range(math.ceil(kStart), math.ceil(kEnd))])
-        ks.append([kEnd])
-        ks = [k for sublist in ks for k in sublist]
-        meanAnoms = np.array(                                               \
-            [0.5*(a+b) + 0.5*(b-a) *math.cos((n-k)/n*math.pi) for k in ks]);
-        meanAnoms = meanAnoms.flatten()
-        times = startTime + period/(2*math.pi) * (meanAnoms - mStart)
-    
-    pos, vel = orb.get_positions(times = times)
+        meanAnoms = cluster_anomalies(a, b, n, np.concatenate((             \
+            [kStart], np.arange(math.ceil(kStart), math.ceil(kEnd)), [kEnd])))
+    times = startTime + period/(2*math.pi) * (meanAnoms - mStart)
+    
+    if tol is None:
+        pos, vel = orb.get_state_vectors(times)
+    else:
+        times, pos, vel = refine_orbit_samples(orb, times, tol, maxPts)
+        meanAnoms = mStart + 2*math.pi/period * (times - startTime)
     pos = np.transpose(pos)
     vel = np.transpose(vel)
     
     if orb.ecc<1:
-        for ii, m in enumerate(meanAnoms):
-            meanAnoms[ii] = Orbit.map_angle(m)
+        meanAnoms = meanAnoms - 2*math.pi*np.floor(meanAnoms/(2*math.pi))
     
     if not dateFormat is None:
         day = dateFormat['day']
@@ -329,7 +408,24 @@ def add_orbit(figure, orb, startTime, endTime=None, numPts=201,
                      "%{customdata[5]:0>2d}" + ":" +\
                      "%{customdata[6]:0>2d}" + "<br>" +\
                      "UT: %{customdata[7]:.3f} s" + "<br>" +\
-                     "Mean Anomaly: %{customdata[8]:.5f} rad" + "<br>" + "<br>" +\
+                     "Mean Anomaly: %{customdata[8]:.5f} rad" + "<br>" + "<br>"
+        if batch:
+            elements = np.array([orb.a, orb.ecc, orb.inc*180/math.pi,
+                                 orb.argp*180/math.pi, orb.lan*180/math.pi,
+                                 orb.mo, orb.epoch])
+            cData = np.concatenate((cData,
+                                    np.tile(elements, (len(times), 1))),
+                                   axis=1)
+            hoverLabel = hoverLabel +\
+                     "Semi-major Axis = %{customdata[9]:.0f} m" + "<br>" +\
+                     "Eccentricity = %{customdata[10]:.4f}" + "<br>" +\
+                     "Inclination = %{customdata[11]:.4f}°" + "<br>" +\
+                     "Argument of the Periapsis = %{customdata[12]:.4f}°" + "<br>" +\
+                     "Longitude of Ascending Node = %{customdata[13]:.4f}°" + "<br>" +\
+                     "Mean Anomaly at Epoch = %{customdata[14]:.4f} rad" + "<br>" +\
+                     "Epoch = %{customdata[15]:.2f} s"
+        else:
+            hoverLabel = hoverLabel +\
                      "Semi-major Axis = " + "{:.0f}".format(orb.a) + " m" + "<br>" +\
                      "Eccentricity = " + "{:.4f}".format(orb.ecc) + "<br>" +\
                      "Inclination = " + "{:.4f}".format(orb.inc*180/math.pi) + "°" + "<br>" +\
@@ -362,6 +458,8 @@ def add_orbit(figure, orb, startTime, endTime=None, numPts=201,
         add_nodes(figure, orb)
     if apses:
         add_apses(figure, orb)
+    
+    return len(times)
 
 def add_apses(figure, orb, size = 4, color = (0,0,255)):
     
@@ -425,26 +523,67 @@ def add_nodes(figure, orb, size = 4, color = (0,255,0)):
                                   hoverinfo = 'skip',
                                   ))
 
-def add_primary(figure, bd, surf = True, lat = None, lon = None, pix = None):
-    
-    fadedColor = fade_color(bd.color)
-    
-    size = 10
-    phi = np.linspace(0, 2*math.pi, size)
-    theta = np.linspace(-math.pi/2, math.pi/2, size)
+def get_sphere_mesh(resolution = SPHERE_RESOLUTION):
+    """Returns the vertices and triangles of a unit sphere centered at the
+    origin, with the given number of rings of latitude between its poles and
+    twice as many meridians. Each resolution's mesh is only built once, so
+    the returned arrays shouldn't be modified.
+    
+    Returns:
+        the x, y, and z coordinates of the vertices, and the i, j, and k
+        vertex indices of the triangles, as Mesh3d takes them
+    """
+    
+    if resolution in sphere_meshes:
+        return sphere_meshes[resolution]
+    
+    numLon = 2*resolution
+    theta = np.linspace(-np.pi/2, np.pi/2, resolution+2)[1:-1]
+    phi = np.linspace(0, 2*np.pi, numLon, endpoint = False)
     phi, theta = np.meshgrid(phi, theta)
     
-    x = bd.eqr * np.cos(theta) * np.sin(phi)
-    y = bd.eqr * np.cos(theta) * np.cos(phi)
-    z = bd.eqr * np.sin(theta)
+    # the south pole, each ring from south to north, then the north pole
+    x = np.concatenate(([0], np.ravel(np.cos(theta) * np.sin(phi)), [0]))
+    y = np.concatenate(([0], np.ravel(np.cos(theta) * np.cos(phi)), [0]))
+    z = np.concatenate(([-1], np.ravel(np.sin(theta)), [1]))
+    northPole = len(z) - 1
+    
+    lon = np.arange(numLon)
+    nextLon = (lon + 1) % numLon
+    ringStarts = 1 + numLon*np.arange(resolution)
+    
+    # caps at the poles, and two triangles for each cell between rings
+    # (ordered so the triangles' normals point outward)
+    triangles = [np.stack((np.zeros(numLon, int),
+                           ringStarts[0] + lon,
+                           ringStarts[0] + nextLon), axis = 1),
+                 np.stack((ringStarts[-1] + nextLon,
+                           ringStarts[-1] + lon,
+                           np.full(numLon, northPole)), axis = 1)]
+    for lower, upper in zip(ringStarts[:-1], ringStarts[1:]):
+        triangles.append(np.stack((lower + lon, upper + lon,
+                                   lower + nextLon), axis = 1))
+        triangles.append(np.stack((lower + nextLon, upper + lon,
+                                   upper + nextLon), axis = 1))
+    i, j, k = np.transpose(np.concatenate(triangles))
+    
+    mesh = (x, y, z, i, j, k)
+    for arr in mesh:
+        arr.setflags(write = False)
+    sphere_meshes[resolution] = mesh
+    return mesh
+
+def add_primary(figure, bd, surf = True, lat = None, lon = None, pix = None,
+                colormap = None):
+    
+    fadedColor = fade_color(bd.color)
     
     if not lat is None:
         xs, ys, zs = lat_lon_to_spherical(lon, lat, bd.eqr)
-        cmap, mapDict, pix = image_colormap(pix, rounded=True)
-        val = []
-        for pick in pix:
-            val.append(mapDict[pick])
-        # val.reverse()
+        if colormap is None:
+            cmap, val, pix = image_colormap(pix, rounded=True)
+        else:
+            cmap, val = colormap
         
         figure.add_trace(go.Surface(
                                     x=xs,
@@ -458,11 +597,14 @@ def add_primary(figure, bd, surf = True, lat = None, lon = None, pix = None):
                                     hovertemplate = "Central body"
                                     ))
     elif surf:
+        x, y, z, i, j, k = get_sphere_mesh()
         figure.add_trace(go.Mesh3d(
-                                    x = np.ndarray.flatten(x),
-                                    y = np.ndarray.flatten(y),
-                                    z = np.ndarray.flatten(z),
-                                    alphahull = 0,
+                                    x = bd.eqr * x,
+                                    y = bd.eqr * y,
+                                    z = bd.eqr * z,
+                                    i = i,
+                                    j = j,
+                                    k = k,
                                     color = 'rgb'+str(fadedColor),
                                     opacity = 0.5,
                                     name = bd.name,
@@ -484,27 +626,22 @@ def add_primary(figure, bd, surf = True, lat = None, lon = None, pix = None):
                                       hovertemplate = "Central body"
                                       ))
 
-def add_body(figure, bd, time, surf=True, pos=None, size=8, symbol='circle'):
+def add_body(figure, bd, time, surf=True, pos=None, size=8, symbol='circle',
+             resolution=SPHERE_RESOLUTION):
     
     if pos is None:
         pos = bd.orb.get_state_vector(time)[0]
     fadedColor = fade_color(bd.color)
     
     if surf:
-        size = 10
-        phi = np.linspace(0, 2*math.pi, size)
-        theta = np.linspace(-math.pi/2, math.pi/2, size)
-        phi, theta = np.meshgrid(phi, theta)
-        
-        x = bd.eqr * np.cos(theta) * np.sin(phi) + pos[0]
-        y = bd.eqr * np.cos(theta) * np.cos(phi) + pos[1]
-        z = bd.eqr * np.sin(theta) + pos[2]
-        
+        x, y, z, i, j, k = get_sphere_mesh(resolution)
         figure.add_trace(go.Mesh3d(
-                                    x = np.ndarray.flatten(x),
-                                    y = np.ndarray.flatten(y),
-                                    z = np.ndarray.flatten(z),
-                                    alphahull = 0,
+                                    x = bd.eqr * x + pos[0],
+                                    y = bd.eqr * y + pos[1],
+                                    z = bd.eqr * z + pos[2],
+                                    i = i,
+                                    j = j,
+                                    k = k,
                                     color = 'rgb'+str(fadedColor),
                                     opacity = 0.5,
                                     showlegend = False,
@@ -524,26 +661,20 @@ def add_body(figure, bd, time, surf=True, pos=None, size=8, symbol='circle'):
                                       hoverinfo = 'skip',
                                       ))
 
-def add_soi(figure, bd, time, pos=None):
+def add_soi(figure, bd, time, pos=None, resolution=SPHERE_RESOLUTION):
     
     if pos is None:
         pos = bd.orb.get_state_vector(time)[0]
     fadedColor = fade_color(bd.color)
     
-    size = 10
-    phi = np.linspace(0, 2*math.pi, size)
-    theta = np.linspace(-math.pi/2, math.pi/2, size)
-    phi, theta = np.meshgrid(phi, theta)
-    
-    x = bd.soi * np.cos(theta) * np.sin(phi) + pos[0]
-    y = bd.soi * np.cos(theta) * np.cos(phi) + pos[1]
-    z = bd.soi * np.sin(theta) + pos[2]
-    
+    x, y, z, i, j, k = get_sphere_mesh(resolution)
     figure.add_trace(go.Mesh3d(
-                                x = np.ndarray.flatten(x),
-                                y = np.ndarray.flatten(y),
-                                z = np.ndarray.flatten(z),
-                                alphahull = 0,
+                                x = bd.soi * x + pos[0],
+                                y = bd.soi * y + pos[1],
+                                z = bd.soi * z + pos[2],
+                                i = i,
+                                j = j,
+                                k = k,
                                 color = 'rgb'+str(fadedColor),
                                 opacity = 0.1,
                                 showlegend = False,
@@ -776,7 +907,66 @@ def add_reference_line(figure, lim, style='dash'):
         showlegend = False,
         ))
 
-def plot_system(fig, centralBody, t, dateFormat, displays, surfTexture='Solid'):
+def get_system_plot_limit(centralBody):
+    """Returns the axis limit for a plot of the system around a body."""
+    
+    if centralBody.soi is None:
+        furthestSatellite = centralBody.satellites[-1]
+        lim = 1.25 * furthestSatellite.orb.a * (1 + furthestSatellite.orb.ecc)
+    else:
+        lim = centralBody.soi
+    
+    if lim < centralBody.eqr * 5:
+        lim = centralBody.eqr * 5
+    
+    try:
+        furthestSatellite = centralBody.satellites[-1]
+        soi = centralBody.soi
+        satLim = furthestSatellite.orb.a * (1 + furthestSatellite.orb.ecc)
+        if soi > 3*satLim:
+            lim = 3*satLim
+    except:
+        pass
+    
+    return lim
+
+def get_detail_level(size, lim):
+    """Returns how much detail to draw for an object of a given size in a
+    plot with axis limit lim: 'full', 'reduced' (fewer points, no markers
+    on orbits), or 'marker' (only the body's marker)."""
+    
+    if size >= DETAIL_REDUCED_RATIO*lim:
+        return 'full'
+    elif size >= DETAIL_MARKER_RATIO*lim:
+        return 'reduced'
+    else:
+        return 'marker'
+
+def get_texture_size(radius, lim):
+    """Returns the size of the smallest level of a texture map's pyramid
+    with enough detail for a body of the given radius in a plot with axis
+    limit lim."""
+    
+    for size in sorted(TEXTURE_MIP_SIZES):
+        if size >= radius/lim * TEXTURE_DETAIL_SCALE:
+            return size
+    return max(TEXTURE_MIP_SIZES)
+
+def plot_system_static(fig, centralBody, t, dateFormat, displays,
+                       surfTexture='Solid', lim=None):
+    """Adds the parts of a system plot that don't change with time: the
+    satellites' orbits (drawn for one period from time t), their apses and
+    nodes, the primary body, and the reference direction line. The primary
+    body's surface is drawn with its rotation at time t, from a level of its
+    texture map's pyramid picked for its size. Orbits that are small
+    compared to the axis limit are drawn with less detail, or not at all.
+    
+    Returns:
+        the axis limit for the plot
+    """
+    
+    if lim is None:
+        lim = get_system_plot_limit(centralBody)
     
     # add all orbits
     if ('orbits' in displays):
@@ -792,62 +982,359 @@ def plot_system(fig, centralBody, t, dateFormat, displays, surfTexture='Solid'):
         
         # add orbits for all satellites around the primary body
         for bd in centralBody.satellites:
-            add_orbit(fig, bd.orb, t, None, 201, dateFormat,                \
-                      apses = apses, nodes = nodes, color = bd.color,       \
-                      name = bd.name);
+            detail = get_detail_level(bd.orb.a*(1+bd.orb.ecc), lim)
+            if detail == 'full':
+                add_orbit(fig, bd.orb, t, None, ORBIT_SEED_POINTS,          \
+                          dateFormat, apses = apses, nodes = nodes,         \
+                          color = bd.color, name = bd.name,                 \
+                          tol = lim*ORBIT_TOLERANCE,                        \
+                          batch = 'batch' in displays);
+            elif detail == 'reduced':
+                add_orbit(fig, bd.orb, t, None, ORBIT_REDUCED_SEED_POINTS,  \
+                          dateFormat, color = bd.color, name = bd.name,     \
+                          tol = lim*ORBIT_TOLERANCE,                        \
+                          batch = 'batch' in displays);
     
     # add the primary body at the origin
     add_primary(fig, centralBody, False)
     if (not surfTexture == 'Solid') and ('3dSurfs' in displays):
         try:
-            mapURL = map_url(centralBody.name, surfTexture+'Small')
-            pix = get_pixel_values(mapURL, True)[0]
-            bodyTheta = 2*np.pi/centralBody.rotPeriod * t + centralBody.rotIni
-            lat = np.array([np.linspace(-np.pi/2, np.pi/2, 512)])
-            lon = np.array([np.linspace(-np.pi, np.pi, 512)]) + bodyTheta
-            add_primary(fig, centralBody, True, lat, lon, pix)
+            texSize = get_texture_size(centralBody.eqr, lim)
+            colormap = get_texture_colormap(centralBody.name,
+                                            surfTexture+'Small', texSize)
+            bodyTheta = get_rotation_angle(centralBody, t)
+            lat = np.array([np.linspace(-np.pi/2, np.pi/2, texSize)])
+            lon = np.array([np.linspace(-np.pi, np.pi, texSize)]) + bodyTheta
+            add_primary(fig, centralBody, True, lat, lon, colormap = colormap)
         except:
             add_primary(fig, centralBody, True)
     elif '3dSurfs' in displays:
         add_primary(fig, centralBody, True)
     
-    # add trace for primary body's position centered at the specified time
-    if not (centralBody == centralBody.orb.prim):
-        add_prograde_trace(fig, centralBody, t);
+    # add reference direction line
+    if 'ref' in displays:
+        add_reference_line(fig, lim)
     
-    # finalize axis limit value
-    if centralBody.soi is None:
-        furthestSatellite = centralBody.satellites[-1]
-        lim = 1.25 * furthestSatellite.orb.a * (1 + furthestSatellite.orb.ecc)
-    else:
-        lim = centralBody.soi
+    return lim
+
+def plot_system_dynamic(fig, centralBody, t, displays, lim=None):
+    """Adds the parts of a system plot that change with time: the primary
+    body's prograde trace, and the satellites' positions and spheres of
+    influence. Surfaces and spheres of influence that would be too small to
+    see at the axis limit are left out.
     
-    if lim < centralBody.eqr * 5:
-        lim = centralBody.eqr * 5
+    Returns:
+        a list with the motion of each added trace, as returned by
+        get_trace_motion
+    """
     
-    try:
-        furthestSatellite = centralBody.satellites[-1]
-        soi = centralBody.soi
-        satLim = furthestSatellite.orb.a * (1 + furthestSatellite.orb.ecc)
-        if soi > 3*satLim:
-            lim = 3*satLim
-    except:
-        pass
+    if lim is None:
+        lim = get_system_plot_limit(centralBody)
     
-    # add reference direction line
-    if 'ref' in displays:
-        add_reference_line(fig, lim)
+    motions = []
+    
+    # add trace for primary body's position centered at the specified time
+    if not (centralBody == centralBody.orb.prim):
+        interval = centralBody.orb.get_period()/8
+        add_prograde_trace(fig, centralBody, t, interval, 201);
+        motions.append(get_trace_motion(centralBody.orb, t, 'prograde',
+                                        interval = interval, numPts = 201))
     
     # add body, SoI positions at specified time
+    resolutions = dict(full = SPHERE_RESOLUTION,
+                       reduced = SPHERE_REDUCED_RESOLUTION)
     for bd in centralBody.satellites:
         add_body(fig, bd, t, False)
-        if ('3dSurfs' in displays):
-            add_body(fig, bd, t, True)
-        if ('SoIs' in displays):
-            add_soi(fig, bd, t)
+        motions.append(get_trace_motion(bd.orb, t))
+        surfDetail = get_detail_level(bd.eqr, lim)
+        if ('3dSurfs' in displays) and not (surfDetail == 'marker'):
+            add_body(fig, bd, t, True,
+                     resolution = resolutions[surfDetail])
+            motions.append(get_trace_motion(bd.orb, t))
+        soiDetail = get_detail_level(bd.soi, lim)
+        if ('SoIs' in displays) and not (soiDetail == 'marker'):
+            add_soi(fig, bd, t, resolution = resolutions[soiDetail])
+            motions.append(get_trace_motion(bd.orb, t))
+    
+    return motions
+
+def get_orbit_elements(orb):
+    """Returns the Keplerian elements of an orbit and the gravitational
+    parameter of its primary body as a dictionary, or None for the
+    stationary root of a system."""
+    
+    if orb.a is None:
+        return None
+    return dict(a = orb.a, ecc = orb.ecc, inc = orb.inc, argp = orb.argp,
+                lan = orb.lan, mo = orb.mo, epoch = orb.epoch,
+                mu = orb.prim.mu)
+
+def get_trace_motion(orb, t, kind = 'translate', startTime = None,
+                     endTime = None, interval = None, numPts = None):
+    """Describes how a trace drawn at time t moves with its orbit, so it can
+    be redrawn for other times in the browser (see assets/figures.js).
+    
+    Args:
+        orb (Orbit): the orbit the trace follows
+        t (float): the time the trace is drawn for (s)
+        kind (string): 'translate' for traces that move with the orbit's
+            position, or 'prograde' for traces from add_prograde_trace
+        startTime, endTime (float): times between which the trace is
+            visible (s), or None if it's always visible
+        interval, numPts: arguments of add_prograde_trace
+    
+    Returns:
+        a dictionary describing the trace's motion
+    """
+    
+    return dict(kind = kind, orbit = get_orbit_elements(orb),
+                time = t, pos = list(orb.get_state_vector(t)[0]),
+                startTime = startTime, endTime = endTime,
+                interval = interval, numPts = numPts)
+
+def move_trace(trace, motion, t):
+    """Returns a copy of a trace (as a dictionary) moved from the time it was
+    drawn for to time t, as described by its motion from get_trace_motion
+    (or batch_traces). The browser does the same in assets/figures.js."""
+    
+    if motion['kind'] == 'batch':
+        # move each merged trace's points, and hide the ones of traces that
+        # aren't visible at time t
+        trace = dict(trace)
+        pos = [[], [], []]
+        for part in motion['parts']:
+            end = part['start'] + part['count']
+            moved = move_trace({'x': trace['x'][part['start']:end],
+                                'y': trace['y'][part['start']:end],
+                                'z': trace['z'][part['start']:end]},
+                               part['motion'], t)
+            for dim, key in zip(pos, ['x', 'y', 'z']):
+                if moved.get('visible', True):
+                    dim.extend(moved[key])
+                else:
+                    dim.extend([np.nan]*part['count'])
+        trace['x'], trace['y'], trace['z'] = [np.array(dim) for dim in pos]
+        return trace
+    
+    trace = dict(trace)
+    if not ((motion['startTime'] is None) and (motion['endTime'] is None)):
+        trace['visible'] = ((motion['startTime'] is None) or                \
+                            (motion['startTime'] <= t)) and                 \
+                           ((motion['endTime'] is None) or                  \
+                            (t < motion['endTime']))
+        if not trace['visible']:
+            return trace
+    if (t == motion['time']) or (motion['orbit'] is None):
+        return trace
+    
+    elements = motion['orbit']
+    orb = Orbit(elements['a'], elements['ecc'], elements['inc'],
+                elements['argp'], elements['lan'], elements['mo'],
+                elements['epoch'], Body(mu = elements['mu']))
+    
+    if motion['kind'] == 'prograde':
+        # redraw the trace centered at time t, as add_prograde_trace
+        times = np.linspace(t - motion['interval'], t + motion['interval'],
+                            motion['numPts'])
+        pos = np.transpose(orb.get_positions(times = times)[0])
+        pos = [dim - dim[int(len(dim)/2)] for dim in pos]
+        trace['x'], trace['y'], trace['z'] = pos
+        trace['line'] = dict(trace['line'], color = times)
+        return trace
+    
+    dPos = orb.get_state_vector(t)[0] - np.array(motion['pos'])
+    trace['x'] = np.array(trace['x']) + dPos[0]
+    trace['y'] = np.array(trace['y']) + dPos[1]
+    trace['z'] = np.array(trace['z']) + dPos[2]
+    return trace
+
+def get_point_colors(color, colorscale, numPts):
+    """Returns the color of each of a trace's points as a hex string, from
+    its line or marker color, which is either one color or an array of
+    values on the colorscale."""
+    
+    if isinstance(color, str):
+        return [color] * numPts
+    
+    vals = np.asarray(color, dtype=float)
+    span = np.max(vals) - np.min(vals)
+    if span > 0:
+        fracs = (vals - np.min(vals)) / span
+    else:
+        fracs = np.zeros(numPts)
+    stops = [stop[0] for stop in colorscale]
+    stopColors = np.array([unlabel_rgb(stop[1]) for stop in colorscale])
+    rgb = np.stack([np.interp(fracs, stops, stopColors[:,ii])
+                    for ii in range(3)], axis=1)
+    return ['#{:02x}{:02x}{:02x}'.format(*c)
+            for c in np.round(rgb).astype(int).tolist()]
+
+def get_batch_key(trace, motion = None):
+    """Returns a key shared by the traces that batch_traces can merge with
+    this one, or None if it can't be merged."""
+    
+    if not (trace.get('type') == 'scatter3d') or                            \
+       not (trace.get('mode') in ['lines', 'markers']):
+        return None
+    if motion is None:
+        if trace.get('visible', True) is False:
+            return None
+    elif not (motion['kind'] == 'translate'):
+        return None
+    
+    if trace['mode'] == 'lines':
+        style = trace.get('line', dict())
+        styleKey = (style.get('dash'), style.get('width'))
+    else:
+        style = trace.get('marker', dict())
+        styleKey = (style.get('symbol'), style.get('opacity'))
+    if style.get('color') is None:
+        return None
+    
+    customdata = trace.get('customdata')
+    if customdata is None:
+        dataShape = None
+    else:
+        dataShape = np.shape(customdata)[1:]
     
+    return (trace['mode'], styleKey, trace.get('hovertemplate'),
+            trace.get('hoverinfo'), dataShape)
+
+def merge_traces(traces):
+    """Merges Scatter3d traces (as dictionaries) that share a key from
+    get_batch_key into one trace. Lines are separated by gaps, and each
+    point keeps its trace's color, size, hover data, and name."""
+    
+    first = traces[0]
+    lines = first['mode'] == 'lines'
+    styleName = 'line' if lines else 'marker'
+    
+    pos = [[], [], []]
+    colors = []
+    sizes = []
+    customdata = []
+    names = []
+    for trace in traces:
+        numPts = len(trace['x'])
+        style = trace[styleName]
+        for dim, key in zip(pos, ['x', 'y', 'z']):
+            dim.extend(np.asarray(trace[key], dtype=float))
+        colors.extend(get_point_colors(style['color'],
+                                       style.get('colorscale'), numPts))
+        sizes.extend([style.get('size')] * numPts)
+        if not trace.get('customdata') is None:
+            customdata.append(np.asarray(trace['customdata'], dtype=float))
+        names.extend([trace.get('name', '')] * numPts)
+        
+        # leave a gap between lines
+        if lines:
+            for dim in pos:
+                dim.append(np.nan)
+            colors.append(colors[-1])
+            sizes.append(sizes[-1])
+            if customdata:
+                customdata.append(np.full((1,) + customdata[-1].shape[1:],
+                                          np.nan))
+            names.append(names[-1])
+    
+    merged = dict(first)
+    merged['x'], merged['y'], merged['z'] = [np.array(dim) for dim in pos]
+    merged[styleName] = dict(first[styleName], color = colors)
+    merged[styleName].pop('colorscale', None)
+    if not lines and not first['marker'].get('size') is None:
+        merged['marker']['size'] = sizes
+    if customdata:
+        merged['customdata'] = np.concatenate(customdata)
+    
+    # the trace names are shown in hover labels as the point text
+    template = first.get('hovertemplate')
+    if not template is None:
+        merged['text'] = names
+        if not '<extra>' in template:
+            merged['hovertemplate'] = template + '<extra>%{text}</extra>'
+    merged.pop('visible', None)
+    return merged
+
+def batch_traces(data, motions = None):
+    """Merges a figure's Scatter3d traces that plotly would otherwise draw
+    separately: all lines with the same style and hover template become one
+    trace, and so do all markers with the same symbol and hover template.
+    Plotly draws a few large traces much faster than many small ones.
+    
+    Args:
+        data (list): the figure's traces, as dictionaries
+        motions (list): the motion of each trace, as returned by
+            get_trace_motion, for traces that are moved in the browser
+    
+    Returns:
+        the merged traces, and their motions if motions were given
+    """
+    
+    groups = dict()
+    for idx, trace in enumerate(data):
+        if motions is None:
+            key = get_batch_key(trace)
+        else:
+            key = get_batch_key(trace, motions[idx])
+        if key is None:
+            key = idx
+        groups.setdefault(key, []).append(idx)
+    
+    newData = []
+    newMotions = []
+    for idxs in groups.values():
+        if len(idxs) == 1:
+            newData.append(data[idxs[0]])
+            if not motions is None:
+                newMotions.append(motions[idxs[0]])
+            continue
+        
+        traces = [data[idx] for idx in idxs]
+        newData.append(merge_traces(traces))
+        if not motions is None:
+            parts = []
+            start = 0
+            for trace, idx in zip(traces, idxs):
+                parts.append(dict(start = start, count = len(trace['x']),
+                                  motion = motions[idx]))
+                start = start + len(trace['x'])
+                if trace['mode'] == 'lines':
+                    start = start + 1
+            newMotions.append(dict(kind = 'batch', parts = parts))
+    
+    if motions is None:
+        return newData
+    return newData, newMotions
+
+def plot_system(fig, centralBody, t, dateFormat, displays, surfTexture='Solid',
+                lim=None):
+    
+    lim = plot_system_static(fig, centralBody, t, dateFormat, displays,
+                             surfTexture, lim)
+    plot_system_dynamic(fig, centralBody, t, displays, lim)
+    
+    # merge the traces if the batch rendering mode is on
+    if 'batch' in displays:
+        data = batch_traces(fig.to_dict()['data'])
+        fig.data = []
+        fig.add_traces(data)
     return lim
 
+def get_rotation_angle(bd, t):
+    """Returns the rotation angle of a body about its axis at time t."""
+    return 2*np.pi/bd.rotPeriod * t + bd.rotIni
+
+def rotate_surface_trace(trace, angle):
+    """Returns a copy of a surface trace (as a dictionary) rotated about the
+    z-axis by an angle (radians)."""
+    
+    x = np.array(trace['x'])
+    y = np.array(trace['y'])
+    trace = dict(trace)
+    trace['x'] = x*math.cos(angle) - y*math.sin(angle)
+    trace['y'] = x*math.sin(angle) + y*math.cos(angle)
+    return trace
+
 def set_trajectory_plot_layout(fig, lim, cameraDist=None, uirev=None):
     
     if cameraDist is None:
@@ -909,25 +1396,37 @@ def project_to_surface(orb, times):
     """Takes list of positions and times and projects to body's surface."""
     
     bd = orb.prim
-    positions = orb.get_positions(times=times)[0]
+    times = np.array(times, dtype = float).flatten()
+    positions = orb.get_state_vectors(times)[0]
     
-    bodyThetas = 2*np.pi/bd.rotPeriod * np.array(times) + bd.rotIni
+    bodyThetas = 2*np.pi/bd.rotPeriod * times + bd.rotIni
     sphericalPositions = cartesian_to_spherical(positions)
     
+    # longitudes relative to the rotating body, wrapped to [-pi, pi)
     surfaceCoords = sphericalPositions[:,1:]
-    for ii in range(len(times)):
-        longitude = surfaceCoords[ii,0] - Orbit.map_angle(bodyThetas[ii])
-        count = 0
-        while abs(longitude) > np.pi:
-            longitude =  longitude - np.sign(longitude) * 2*np.pi
-            count = count+1
-            if count > 10:
-                print('Why?')
-                break
-        surfaceCoords[ii,0] = longitude
+    surfaceCoords[:,0] = np.mod(surfaceCoords[:,0] - bodyThetas + np.pi,   \
+                                2*np.pi) - np.pi
     
     return surfaceCoords
 
+def split_at_antimeridian(longLats, values):
+    """Inserts a row of NaNs wherever a ground track crosses the
+    antimeridian, so that lines through it don't wrap across the map.
+    
+    Args:
+        longLats (array): longitudes and latitudes (radians), one row each
+        values (array): values for each point, such as times. The value
+            before each break is repeated for the inserted row.
+    
+    Returns:
+        the split longitudes and latitudes, and values
+    """
+    
+    breaks = np.nonzero(np.abs(np.diff(longLats[:,0])) > np.pi)[0] + 1
+    longLats = np.insert(longLats, breaks, np.nan, axis = 0)
+    values = np.insert(values, breaks, np.asarray(values)[breaks-1])
+    return longLats, values
+
 def add_orbit_surface_projection(fig, orb, startTime, endTime=None, numPts=1001,
                                  name = None,
                                  color=(255, 255, 255),
@@ -950,7 +1449,8 @@ def add_orbit_surface_projection(fig, orb, startTime, endTime=None, numPts=1001,
         times = np.linspace(startTime, endTime, numPts)
         colorscale = [[0.0, "rgb"+str(color)],
                       [1.0, "rgb"+str(fade_color(color, 3))]]
-    longLats = project_to_surface(orb, times)
+    longLats, times = split_at_antimeridian(project_to_surface(orb, times),
+                                            times)
     
     fig.add_trace(go.Scatter(x=longLats[:,0]*180/np.pi, 
                              y=longLats[:,1]*180/np.pi,
@@ -1,10 +1,129 @@
+import os
 import math
+from uuid import uuid4
 import numpy as np
 from numpy.linalg import norm
 from orbit import Orbit
 from body import Body
 from transfer import Transfer
 
+# Record type for the details of the transfer chosen at each table cell
+SUMMARY_DTYPE = np.dtype([('ejectionDV', float, (3,)),
+                          ('insertionDV', float, (3,)),
+                          ('planeChangeDV', float, (3,)),
+                          ('departureBurnTime', float),
+                          ('arrivalBurnTime', float),
+                          ('planeChangeTime', float),
+                          ('phaseAngle', float),
+                          ('ejectionBurnAngle', float),
+                          ('convergenceFail', bool)])
+
+def summarize_transfer(trs):
+    """Returns a record with the burn details of a transfer.
+    
+    Arguments:
+        trs (Transfer): the transfer to be summarized
+    
+    Returns:
+        a numpy record with the SUMMARY_DTYPE fields. Burns that do not 
+        occur are zero vectors, and a missing ejection angle is NaN.
+    """
+    
+    summary = np.zeros((), dtype = SUMMARY_DTYPE)
+    summary['ejectionDV'] = trs.ejectionDV
+    summary['insertionDV'] = trs.insertionDV
+    summary['planeChangeDV'] = trs.planeChangeDV
+    summary['departureBurnTime'] = trs.get_departure_burn_time()
+    summary['arrivalBurnTime'] = trs.get_arrival_burn_time()
+    summary['planeChangeTime'] = trs.get_plane_change_time()
+    summary['phaseAngle'] = trs.phaseAngle
+    if trs.ejectionBurnAngle is None:
+        summary['ejectionBurnAngle'] = np.nan
+    else:
+        summary['ejectionBurnAngle'] = trs.ejectionBurnAngle
+    summary['convergenceFail'] = trs.convergenceFail
+    return summary
+
+def choose_transfer(startOrbit, endOrbit, startTime, flightTime,
+                    transferType = 'ballistic', ignoreInsertion = False,
+                    cheapStartOrb = False, cheapEndOrb = True,
+                    startState = None):
+    """Returns the transfer of the given type with the specified times.
+    
+    Arguments:
+        startOrbit (Orbit): orbit prior to departure burns
+        endOrbit (Orbit): orbit following arrival burns
+        startTime (float): time in seconds since epoch of transfer start
+        flightTime (float): time in seconds of transfer duration
+        transferType (string): 'ballistic', 'plane change', or 'optimal'
+        ignoreInsertion (bool): if true, arrival burn is ignored.
+        cheapStartOrb (bool): if true, the only parameter of the starting
+            park orbit used is the semimajor axis
+        cheapEndOrb (bool): if true, the only parameter of the ending park
+            orbit used is the semimajor axis
+        startState (tuple): if provided, position and velocity of the
+            departure orbit at the start time
+    
+    Returns:
+        The transfer with the specified start and flight times
+    """
+    
+    if transferType == 'ballistic':
+        trs = Transfer(startOrbit, endOrbit, startTime, flightTime,         \
+                       False, ignoreInsertion, cheapStartOrb, cheapEndOrb,  \
+                       startState = startState);
+    
+    elif transferType == 'plane change':
+        trs = Transfer(startOrbit, endOrbit, startTime, flightTime,         \
+                       True, ignoreInsertion, cheapStartOrb, cheapEndOrb,   \
+                       startState = startState);
+    
+    elif transferType == 'optimal':
+        btr = Transfer(startOrbit, endOrbit, startTime, flightTime,         \
+                       False, ignoreInsertion, cheapStartOrb, cheapEndOrb,  \
+                       startState = startState);
+        ptr = Transfer(startOrbit, endOrbit, startTime, flightTime,         \
+                       True, ignoreInsertion, cheapStartOrb, cheapEndOrb,   \
+                       startState = startState);
+        bdv = btr.get_total_delta_v()
+        pdv = ptr.get_total_delta_v()
+        
+        if bdv <= pdv:
+            trs = btr
+        else:
+            trs = ptr
+    
+    else:
+        raise Exception('uncrecognized transfer type')
+    
+    return trs
+
+def get_default_periods(startOrbit, endOrbit):
+    """Returns the periods used to set default porkchop time ranges.
+    
+    Arguments:
+        startOrbit (Orbit): orbit prior to departure burns
+        endOrbit (Orbit): orbit following arrival burns
+    
+    Returns:
+        the periods (s) of the orbits (or of their primary bodies' orbits)
+        between which the transfer takes place
+    """
+    
+    if (endOrbit.prim in startOrbit.prim.satellites or                      \
+        startOrbit.prim == endOrbit.prim):
+            startPeriod = startOrbit.get_period()
+    else:
+        startPeriod = startOrbit.prim.orb.get_period()
+        
+    if (startOrbit.prim in endOrbit.prim.satellites or                      \
+        endOrbit.prim == startOrbit.prim):
+            endPeriod = endOrbit.get_period()
+    else:
+        endPeriod = endOrbit.prim.orb.get_period()
+    
+    return startPeriod, endPeriod
+
 class PorkchopTable:
     """Table of delta v values for transfers between the specified orbits.
     
@@ -30,6 +149,19 @@ class PorkchopTable:
         flightTimes (floats): list hold all flight times sampled (s)
         deltaV: a table of values with the sum of the magnitue of all burn 
             maneuvers (m/s) at each choice of start and flight times
+        storageDir (string): if provided, the tables are stored as 
+            memory-mapped files in this directory instead of in memory.
+            The files are deleted by close(), or when the table is used as
+            a context manager.
+        storageId (string): unique part of the names of this table's files,
+            so that tables can share a storage directory
+        tileSize (int): number of rows and columns of the table computed 
+            between flushes of memory-mapped files to disk
+        storeSummaries (bool): if true, the burn details of the transfer at
+            each cell are kept in the summaries table
+        summaries (array): if storeSummaries is true, a structured table 
+            with a SUMMARY_DTYPE record for each choice of start and flight 
+            times
     
     """
     
@@ -38,7 +170,9 @@ class PorkchopTable:
                  cheapStartOrb = False, cheapEndOrb = True,
                  minStartTime = 0, maxStartTime = None, 
                  minFlightTime = None, maxFlightTime = None,
-                 startTimeSize = 25, flightTimeSize = 25):
+                 startTimeSize = 25, flightTimeSize = 25,
+                 storageDir = None, tileSize = 64,
+                 storeSummaries = False):
         
         self.startOrbit = startOrbit
         self.endOrbit = endOrbit
@@ -49,18 +183,17 @@ class PorkchopTable:
         self.minStartTime = minStartTime
         self.startTimeSize = startTimeSize
         self.flightTimeSize = flightTimeSize
+        self.storageDir = storageDir
+        self.tileSize = tileSize
+        self.storeSummaries = storeSummaries
+        self.storageId = uuid4().hex
+        self.storageCount = 0
         
-        if (endOrbit.prim in startOrbit.prim.satellites or                  \
-            startOrbit.prim == endOrbit.prim):
-                startPeriod = startOrbit.get_period()
-        else:
-            startPeriod = startOrbit.prim.orb.get_period()
-            
-        if (startOrbit.prim in endOrbit.prim.satellites or                  \
-            endOrbit.prim == startOrbit.prim):
-                endPeriod = endOrbit.get_period()
-        else:
-            endPeriod = endOrbit.prim.orb.get_period()
+        if not storageDir is None:
+            if not os.path.exists(storageDir):
+                os.makedirs(storageDir)
+        
+        startPeriod, endPeriod = get_default_periods(startOrbit, endOrbit)
         
         if maxStartTime is None:
             self.maxStartTime = minStartTime + 2 * min(startPeriod,endPeriod)
@@ -90,6 +223,7 @@ class PorkchopTable:
         self.totalDeltaV = None
         self.ejectionDeltaV = None
         self.insertionDeltaV = None
+        self.summaries = None
         
         # Fill in the empty attributes
         self.fill_table()
@@ -98,86 +232,574 @@ class PorkchopTable:
     def fill_table(self):
         """Calculates the delta v for each choice of start and flight time."""
         
-        # f = open('gens.csv','w')
-        
-        totalDeltaVTable = np.zeros((self.flightTimeSize,self.startTimeSize))
-        ejectDeltaVTable = np.zeros((self.flightTimeSize,self.startTimeSize))
-        insertDeltaVTable = np.zeros((self.flightTimeSize,self.startTimeSize))
-        
-        
-        for xx, flightTime in enumerate(self.flightTimes, start=0):
-            for yy, startTime in enumerate(self.startTimes, start=0):
-                # trs, gen = self.get_chosen_transfer(startTime, flightTime)
-                # f.write(str(startTime))
-                # f.write(',')
-                # f.write(str(flightTime))
-                # f.write(',')
-                # f.write(str(gen))
-                # f.write(',')
-                # f.write(str(trs.convergenceFail))
-                # f.write(',')
-                # f.write('\n')
-                trs = self.get_chosen_transfer(startTime, flightTime)
-                totalDeltaVTable[xx][yy] = trs.get_total_delta_v()
-                ejectDeltaVTable[xx][yy] = norm(trs.ejectionDV)
-                insertDeltaVTable[xx][yy] = norm(trs.insertionDV)
-        # f.close()
-        self.totalDeltaV = totalDeltaVTable
-        self.ejectionDeltaV = ejectDeltaVTable
-        self.insertionDeltaV = insertDeltaVTable
+        shape = (self.flightTimeSize,self.startTimeSize)
+        self.totalDeltaV = self.make_table('totalDeltaV', shape)
+        self.ejectionDeltaV = self.make_table('ejectionDeltaV', shape)
+        self.insertionDeltaV = self.make_table('insertionDeltaV', shape)
+        if self.storeSummaries:
+            self.summaries = self.make_table('summaries', shape,            \
+                                             SUMMARY_DTYPE)
+        
+        self.fill_cells()
+    
+    
+    def make_table(self, name, shape, dtype = float):
+        """Creates an empty table, memory-mapped if a storage dir is set.
+        
+        Arguments:
+            name (string): name of the table, used for its file name
+            shape (tuple): number of flight times and start times
+            dtype: numpy data type of the table entries
+        
+        Returns:
+            an array of zeros with the given shape
+        """
+        
+        if self.storageDir is None:
+            return np.zeros(shape, dtype = dtype)
+        
+        # every table gets a new file, so that previous tables remain 
+        # readable while their values are copied over
+        self.storageCount = self.storageCount + 1
+        path = os.path.join(self.storageDir,                                \
+                            name + '_' + self.storageId + '_' +             \
+                            str(self.storageCount) + '.dat')
+        return np.memmap(path, dtype = dtype, mode = 'w+', shape = shape)
+    
+    
+    @staticmethod
+    def remove_table(table):
+        """Deletes the file backing a memory-mapped table, if there is one."""
+        
+        if isinstance(table, np.memmap) and not table.filename is None:
+            try:
+                os.remove(table.filename)
+            except OSError:
+                pass
+    
+    
+    def get_tables(self):
+        """Returns a dictionary of all tables held, keyed by their names."""
+        
+        tables = dict(totalDeltaV = self.totalDeltaV,
+                      ejectionDeltaV = self.ejectionDeltaV,
+                      insertionDeltaV = self.insertionDeltaV)
+        if not self.summaries is None:
+            tables['summaries'] = self.summaries
+        return tables
+    
+    
+    def flush(self):
+        """Writes any changes in memory-mapped tables to disk."""
+        
+        for table in self.get_tables().values():
+            if isinstance(table, np.memmap):
+                table.flush()
+    
+    
+    def close(self):
+        """Deletes the files backing memory-mapped tables. The table's values
+        are no longer available afterwards."""
+        
+        for table in self.get_tables().values():
+            self.remove_table(table)
+        self.totalDeltaV = None
+        self.ejectionDeltaV = None
+        self.insertionDeltaV = None
+        self.summaries = None
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+    
+    
+    def fill_cells(self, mask = None):
+        """Calculates the delta v for the cells selected by a boolean mask.
+        
+        The table is filled one tile at a time, and memory-mapped tables are
+        flushed to disk after each tile.
+        
+        Arguments:
+            mask (array): boolean array with the same shape as the table,
+                true where the cell should be (re)computed. If not provided,
+                all cells are computed.
+        """
+        
+        for x0 in range(0, self.flightTimeSize, self.tileSize):
+            for y0 in range(0, self.startTimeSize, self.tileSize):
+                x1 = min(x0 + self.tileSize, self.flightTimeSize)
+                y1 = min(y0 + self.tileSize, self.startTimeSize)
+                if mask is None:
+                    tileMask = np.ones((x1-x0, y1-y0), dtype = bool)
+                else:
+                    tileMask = mask[x0:x1, y0:y1]
+                
+                for xx, yy in zip(*np.nonzero(tileMask)):
+                    self.fill_cell(x0+xx, y0+yy)
+                self.flush()
+    
+    
+    def fill_cell(self, xx, yy):
+        """Calculates the delta v for a single cell of the table.
+        
+        Arguments:
+            xx (int): index of the flight time
+            yy (int): index of the start time
+        """
+        
+        trs = self.get_chosen_transfer(self.startTimes[yy],                 \
+                                       self.flightTimes[xx])
+        self.totalDeltaV[xx][yy] = trs.get_total_delta_v()
+        self.ejectionDeltaV[xx][yy] = norm(trs.ejectionDV)
+        self.insertionDeltaV[xx][yy] = norm(trs.insertionDV)
+        if not self.summaries is None:
+            self.summaries[xx][yy] = summarize_transfer(trs)
+    
+    
+    @staticmethod
+    def match_times(oldTimes, newTimes, tol = 1E-6):
+        """Finds the indices of previously sampled times in a new time axis.
+        
+        Arguments:
+            oldTimes (array): sorted times already in the table (s)
+            newTimes (array): times of the new axis (s)
+            tol (float): relative tolerance for two times to coincide
+        
+        Returns:
+            array of indices into oldTimes for each new time, or -1 where 
+            the new time does not coincide with an old one
+        """
+        
+        oldTimes = np.asarray(oldTimes, dtype = float)
+        newTimes = np.asarray(newTimes, dtype = float)
+        indices = -np.ones(len(newTimes), dtype = int)
+        if len(oldTimes) == 0:
+            return indices
+        
+        # absolute tolerance scaled by the magnitude of the sampled times
+        atol = tol * max(np.amax(np.abs(oldTimes)), 1)
+        
+        right = np.clip(np.searchsorted(oldTimes, newTimes),                \
+                        0, len(oldTimes)-1)
+        left = np.clip(right-1, 0, len(oldTimes)-1)
+        nearest = np.where(np.abs(oldTimes[left]-newTimes) <                \
+                           np.abs(oldTimes[right]-newTimes), left, right)
+        matched = np.abs(oldTimes[nearest]-newTimes) <= atol
+        indices[matched] = nearest[matched]
+        return indices
+    
+    
+    @staticmethod
+    def extend_axis(times, newMin = None, newMax = None):
+        """Extends a time axis while keeping its spacing.
+        
+        The new limits are rounded outward to a whole number of steps so that
+        every existing sample remains on the new axis.
+        
+        Arguments:
+            times (array): evenly spaced times (s)
+            newMin (float): desired earliest time (s)
+            newMax (float): desired latest time (s)
+        
+        Returns:
+            the extended array of times
+        """
+        
+        minTime = times[0]
+        maxTime = times[-1]
+        if newMin is None or newMin > minTime:
+            newMin = minTime
+        if newMax is None or newMax < maxTime:
+            newMax = maxTime
+        
+        if len(times) < 2:
+            if newMin == newMax:
+                return np.array(times, dtype = float)
+            return np.linspace(newMin, newMax, num = 2)
+        
+        step = (maxTime-minTime)/(len(times)-1)
+        numBefore = math.ceil((minTime-newMin)/step - 1E-9)
+        numAfter = math.ceil((newMax-maxTime)/step - 1E-9)
+        
+        return np.linspace(minTime - numBefore*step,                        \
+                           maxTime + numAfter*step,                         \
+                           num = len(times) + numBefore + numAfter)
+    
+    
+    def resample(self, startTimes, flightTimes):
+        """Changes the sampled times, reusing values at coinciding samples.
+        
+        Only the cells whose start or flight time do not coincide with a
+        previously sampled time are calculated.
+        
+        Arguments:
+            startTimes (array): sorted start times to be sampled (s)
+            flightTimes (array): sorted flight times to be sampled (s)
+        """
+        
+        startTimes = np.asarray(startTimes, dtype = float)
+        flightTimes = np.asarray(flightTimes, dtype = float)
+        
+        startIdxs = self.match_times(self.startTimes, startTimes)
+        flightIdxs = self.match_times(self.flightTimes, flightTimes)
+        
+        # cells where both the start and flight time were already sampled
+        known = np.outer(flightIdxs >= 0, startIdxs >= 0)
+        
+        newShape = (len(flightTimes), len(startTimes))
+        newTables = dict()
+        for name, table in self.get_tables().items():
+            newTables[name] = self.make_table(name, newShape, table.dtype)
+            self.copy_cells(table, newTables[name], flightIdxs, startIdxs)
+            self.remove_table(table)
+        
+        self.startTimes = startTimes
+        self.flightTimes = flightTimes
+        self.minStartTime = startTimes[0]
+        self.maxStartTime = startTimes[-1]
+        self.minFlightTime = flightTimes[0]
+        self.maxFlightTime = flightTimes[-1]
+        self.startTimeSize = len(startTimes)
+        self.flightTimeSize = len(flightTimes)
+        self.totalDeltaV = newTables['totalDeltaV']
+        self.ejectionDeltaV = newTables['ejectionDeltaV']
+        self.insertionDeltaV = newTables['insertionDeltaV']
+        if 'summaries' in newTables:
+            self.summaries = newTables['summaries']
+        
+        self.fill_cells(~known)
+    
+    
+    def copy_cells(self, table, newTable, flightIdxs, startIdxs):
+        """Copies the values of previously sampled cells into a new table.
+        
+        The new table is filled one tile at a time, so that memory-mapped
+        tables are never loaded fully.
+        
+        Arguments:
+            table (array): the table with the previous samples
+            newTable (array): the table with the new samples
+            flightIdxs (array): index of each new flight time in the previous
+                flight times, or -1, as returned by match_times
+            startIdxs (array): index of each new start time in the previous
+                start times, or -1, as returned by match_times
+        """
+        
+        for x0 in range(0, newTable.shape[0], self.tileSize):
+            rows = flightIdxs[x0:x0+self.tileSize]
+            if not np.any(rows >= 0):
+                continue
+            for y0 in range(0, newTable.shape[1], self.tileSize):
+                cols = startIdxs[y0:y0+self.tileSize]
+                if not np.any(cols >= 0):
+                    continue
+                tile = newTable[x0:x0+self.tileSize, y0:y0+self.tileSize]
+                tile[np.ix_(rows >= 0, cols >= 0)] =                        \
+                    table[np.ix_(rows[rows >= 0], cols[cols >= 0])]
+            if isinstance(newTable, np.memmap):
+                newTable.flush()
+    
+    
+    def extend(self, minStartTime = None, maxStartTime = None,
+               minFlightTime = None, maxFlightTime = None):
+        """Extends the sampled time ranges, keeping the current spacing.
+        
+        Arguments:
+            minStartTime (float): new earliest start time (s)
+            maxStartTime (float): new latest start time (s)
+            minFlightTime (float): new shortest flight time (s)
+            maxFlightTime (float): new longest flight time (s)
+        """
+        
+        startTimes = self.extend_axis(self.startTimes,                      \
+                                      minStartTime, maxStartTime)
+        flightTimes = self.extend_axis(self.flightTimes,                    \
+                                       minFlightTime, maxFlightTime)
+        self.resample(startTimes, flightTimes)
+    
+    
+    def shift(self, startShift = 0, flightShift = 0):
+        """Moves the sampled time windows, keeping their size and spacing.
+        
+        Shifts are rounded to a whole number of steps so that samples in the
+        overlap of the old and new windows are reused.
+        
+        Arguments:
+            startShift (float): time added to the start time window (s)
+            flightShift (float): time added to the flight time window (s)
+        """
+        
+        def shift_axis(times, dt):
+            if len(times) < 2:
+                return times + dt
+            step = (times[-1]-times[0])/(len(times)-1)
+            return times + round(dt/step)*step
+        
+        self.resample(shift_axis(self.startTimes, startShift),              \
+                      shift_axis(self.flightTimes, flightShift))
+    
+    
+    def densify(self, startFactor = 2, flightFactor = 2):
+        """Subdivides the sample spacing, keeping the current samples.
+        
+        Arguments:
+            startFactor (int): number of intervals each start time interval
+                is split into
+            flightFactor (int): number of intervals each flight time interval
+                is split into
+        """
+        
+        startTimes = np.linspace(self.minStartTime, self.maxStartTime,      \
+                                 num = (self.startTimeSize-1)*startFactor+1)
+        flightTimes = np.linspace(self.minFlightTime, self.maxFlightTime,   \
+                                  num = (self.flightTimeSize-1)*flightFactor+1)
+        self.resample(startTimes, flightTimes)
     
     
     def get_best_transfer(self):
-        """Returns the transfer with the lowest delta V among sampled points."""
+        """Returns the transfer with the lowest delta V among sampled points.
+        
+        Raises:
+            ValueError: if no sampled point has a delta v value
+        """
+        
+        # search one block of rows at a time so that memory-mapped tables
+        # are never loaded fully
+        minDV = math.inf
+        index = None
+        for x0 in range(0, self.flightTimeSize, self.tileSize):
+            block = np.asarray(self.totalDeltaV[x0:x0+self.tileSize])
+            if np.all(np.isnan(block)):
+                continue
+            xx, yy = np.unravel_index(np.nanargmin(block), block.shape)
+            if block[xx][yy] < minDV:
+                minDV = block[xx][yy]
+                index = (x0+xx, yy)
         
-        minDV = np.nanmin(self.totalDeltaV)
-        index = np.where(self.totalDeltaV == minDV)
+        if index is None:
+            raise ValueError('no transfer in the porkchop table has a '     \
+                             'delta v value')
         
-        startTime = self.startTimes[index[1][0]]
-        flightTime = self.flightTimes[index[0][0]]
+        startTime = self.startTimes[index[1]]
+        flightTime = self.flightTimes[index[0]]
         
         return self.get_chosen_transfer(startTime, flightTime) # [0]
     
-    def get_chosen_transfer (self, startTime, flightTime):
+    def get_plot_data(self, maxStartTimeSize = 250, maxFlightTimeSize = 250):
+        """Returns an evenly strided subset of the table for plotting.
+        
+        Only the selected rows and columns are read, so memory-mapped tables
+        are not loaded fully.
+        
+        Arguments:
+            maxStartTimeSize (int): maximum number of start times returned
+            maxFlightTimeSize (int): maximum number of flight times returned
+        
+        Returns:
+            arrays of start times, flight times, and total delta v values
+        """
+        
+        startStep = math.ceil(self.startTimeSize/maxStartTimeSize)
+        flightStep = math.ceil(self.flightTimeSize/maxFlightTimeSize)
+        
+        return self.startTimes[::startStep],                                \
+               self.flightTimes[::flightStep],                              \
+               np.array(self.totalDeltaV[::flightStep, ::startStep])
+    
+    def get_summary(self, startTime, flightTime):
+        """Returns the stored burn details at the specified times.
+        
+        Arguments:
+            startTime (float): time in seconds since epoch of transfer start
+            flightTIme (float): time in seconds of transfer duration
+        
+        Returns:
+            The SUMMARY_DTYPE record of the cell with the specified start and
+            flight times, or None if summaries are not stored or the times 
+            were not sampled
+        """
+        
+        if self.summaries is None:
+            return None
+        
+        yy = self.match_times(self.startTimes, [startTime])[0]
+        xx = self.match_times(self.flightTimes, [flightTime])[0]
+        if xx < 0 or yy < 0:
+            return None
+        
+        return np.array(self.summaries[xx][yy])
+    
+    def get_chosen_transfer (self, startTime, flightTime, startState = None):
         """Returns the transfer with the specified start and flight times.
         
         Arguments:
             startTime (float): time in seconds since epoch of transfer start
             flightTIme (float): time in seconds of transfer duration
+            startState (tuple): if provided, position and velocity of the
+                departure orbit at the start time
             
         Returns:
             The transfer at with the specified start and flight times
         """
         
-        if self.transferType == 'ballistic':
-            trs = Transfer(self.startOrbit, self.endOrbit, startTime,       \
-                            flightTime, False, self.ignoreInsertion,        \
-                            self.cheapStartOrb, self.cheapEndOrb);
-        
-        elif self.transferType == 'plane change':
-            trs = Transfer(self.startOrbit, self.endOrbit, startTime,       \
-                            flightTime, True, self.ignoreInsertion,         \
-                            self.cheapStartOrb, self.cheapEndOrb);
-        
-        elif self.transferType == 'optimal':
-            btr = Transfer(self.startOrbit, self.endOrbit,                  \
-                                   startTime, flightTime,                   \
-                                   False, self.ignoreInsertion,             \
-                                   self.cheapStartOrb, self.cheapEndOrb);
-            ptr = Transfer(self.startOrbit, self.endOrbit,                  \
-                                   startTime, flightTime,                   \
-                                   True, self.ignoreInsertion,              \
-                                   self.cheapStartOrb, self.cheapEndOrb);
-            bdv = btr.get_total_delta_v()
-            pdv = ptr.get_total_delta_v()
-                    
-            if bdv <= pdv:
-                trs = btr
-            else:
-                trs = ptr
+        return choose_transfer(self.startOrbit, self.endOrbit,              \
+                               startTime, flightTime, self.transferType,    \
+                               self.ignoreInsertion,                        \
+                               self.cheapStartOrb, self.cheapEndOrb,        \
+                               startState)
+
+
+class MultiTargetPorkchopTable:
+    """Tables of delta v values for transfers from one orbit to several.
+    
+    The departure orbit's state at each start time is calculated once and 
+    shared by the transfers to every target.
+    
+    Attributes:
+        startOrbit (Orbit): orbit prior to departure burns
+        endOrbits (list): orbits following arrival burns, one per target
+        transferType (string): specifies whether the transfer is ballistic,
+            has a plane change maneuver, or is the "cheaper" of the two
+        ignoreInsertion (bool): if true, arrival burn is ignored.
+        cheapStartOrb (bool): if true, the only parameter of the starting
+            park orbit used is the semimajor axis
+        cheapEndOrb (bool): if true, the only parameter of the ending park
+            orbit used is the semimajor axis
+        startTimes (floats): start times sampled, shared by all targets (s)
+        flightTimes (array): flight times sampled for each target (s), with
+            one row per target
+        totalDeltaV (array): cube of total delta v values (m/s), indexed by
+            target, flight time, and start time
+        ejectionDeltaV (array): cube of departure burn delta v values (m/s)
+        insertionDeltaV (array): cube of arrival burn delta v values (m/s)
+    
+    """
+    
+    def __init__(self, startOrbit, endOrbits, transferType = 'ballistic',
+                 ignoreInsertion = False,
+                 cheapStartOrb = False, cheapEndOrb = True,
+                 minStartTime = 0, maxStartTime = None,
+                 minFlightTimes = None, maxFlightTimes = None,
+                 startTimeSize = 25, flightTimeSize = 25):
         
+        self.startOrbit = startOrbit
+        self.endOrbits = endOrbits
+        self.transferType = transferType
+        self.ignoreInsertion = ignoreInsertion
+        self.cheapStartOrb = cheapStartOrb
+        self.cheapEndOrb = cheapEndOrb
+        self.minStartTime = minStartTime
+        self.startTimeSize = startTimeSize
+        self.flightTimeSize = flightTimeSize
+        
+        periods = [get_default_periods(startOrbit, endOrb)                  \
+                   for endOrb in endOrbits]
+        
+        # the start window must be long enough for each of the targets
+        if maxStartTime is None:
+            self.maxStartTime = minStartTime +                              \
+                2 * max([min(sp, ep) for sp, ep in periods])
         else:
-            raise Exception('uncrecognized transfer type')
+            self.maxStartTime = maxStartTime
+        
+        if minFlightTimes is None:
+            minFlightTimes = [None for endOrb in endOrbits]
+        if maxFlightTimes is None:
+            maxFlightTimes = [None for endOrb in endOrbits]
+        
+        self.startTimes = np.linspace(self.minStartTime,                    \
+                                      self.maxStartTime,                    \
+                                      num = self.startTimeSize)
+        self.flightTimes = np.zeros((len(endOrbits), self.flightTimeSize))
+        for tt, (startPeriod, endPeriod) in enumerate(periods):
+            minFlightTime = minFlightTimes[tt]
+            maxFlightTime = maxFlightTimes[tt]
+            if minFlightTime is None:
+                minFlightTime = math.sqrt((startPeriod+endPeriod)**2)/8
+            if maxFlightTime is None:
+                maxFlightTime = minFlightTime * 4
+            if minFlightTime > maxFlightTime:
+                minFlightTime = maxFlightTime/4
+            self.flightTimes[tt] = np.linspace(minFlightTime,               \
+                                               maxFlightTime,               \
+                                               num = self.flightTimeSize)
+        
+        # The attributes defined here will be filled in with methods
+        self.totalDeltaV = None
+        self.ejectionDeltaV = None
+        self.insertionDeltaV = None
+        
+        # Fill in the empty attributes
+        self.fill_table()
+    
+    
+    def fill_table(self):
+        """Calculates the delta v for each target, start and flight time."""
+        
+        shape = (len(self.endOrbits), self.flightTimeSize, self.startTimeSize)
+        self.totalDeltaV = np.zeros(shape)
+        self.ejectionDeltaV = np.zeros(shape)
+        self.insertionDeltaV = np.zeros(shape)
+        
+        # targets are grouped by the orbit in which their transfers begin
+        departureOrbits = [Transfer.get_departure_orbit(self.startOrbit,    \
+                                                        endOrb)             \
+                           for endOrb in self.endOrbits]
+        
+        for yy, startTime in enumerate(self.startTimes):
+            startStates = {}
+            for tt, endOrb in enumerate(self.endOrbits):
+                depOrb = departureOrbits[tt]
+                if not id(depOrb) in startStates:
+                    startStates[id(depOrb)] = depOrb.get_state_vector(startTime)
+                startState = startStates[id(depOrb)]
+                
+                for xx, flightTime in enumerate(self.flightTimes[tt]):
+                    trs = self.get_chosen_transfer(tt, startTime, flightTime,\
+                                                   startState)
+                    self.totalDeltaV[tt][xx][yy] = trs.get_total_delta_v()
+                    self.ejectionDeltaV[tt][xx][yy] = norm(trs.ejectionDV)
+                    self.insertionDeltaV[tt][xx][yy] = norm(trs.insertionDV)
+    
+    
+    def get_best_transfer(self, targetIdx):
+        """Returns the lowest delta V transfer to a target among samples.
+        
+        Arguments:
+            targetIdx (int): index of the target in endOrbits
+        
+        Returns:
+            The transfer with the lowest delta V to the target
+        """
+        
+        table = self.totalDeltaV[targetIdx]
+        xx, yy = np.unravel_index(np.nanargmin(table), table.shape)
+        
+        return self.get_chosen_transfer(targetIdx, self.startTimes[yy],     \
+                                        self.flightTimes[targetIdx][xx])
+    
+    
+    def get_chosen_transfer(self, targetIdx, startTime, flightTime,
+                            startState = None):
+        """Returns the transfer to a target with the specified times.
+        
+        Arguments:
+            targetIdx (int): index of the target in endOrbits
+            startTime (float): time in seconds since epoch of transfer start
+            flightTime (float): time in seconds of transfer duration
+            startState (tuple): if provided, position and velocity of the
+                departure orbit at the start time
+        
+        Returns:
+            The transfer to the target with the specified times
+        """
         
-        # gen = trs.genetic_refine()
-        return trs # , gen
+        return choose_transfer(self.startOrbit, self.endOrbits[targetIdx],  \
+                               startTime, flightTime, self.transferType,    \
+                               self.ignoreInsertion,                        \
+                               self.cheapStartOrb, self.cheapEndOrb,        \
+                               startState)
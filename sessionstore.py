@@ -0,0 +1,242 @@
+"""Server-side storage for objects referenced by the app's hidden divs."""
+import os
+import re
+import time
+import pickle
+import threading
+from uuid import uuid4
+from collections import OrderedDict
+
+# keys come from the browser, so only plain names are used to look up
+# stored objects (never paths)
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+
+def is_valid_key(key):
+    """Returns whether a key can be used in the store and its backends."""
+    return isinstance(key, str) and not KEY_PATTERN.match(key) is None
+
+class FileBackend:
+    """Stores serialized objects as files in a local directory.
+    
+    Has the same get/set/delete interface as a Redis client, so either can
+    be used as the shared backend of a SessionStore. Like Redis keys, the
+    files expire: each file's modification time is set to its expiry time.
+    Expired files are removed at most once per pruneInterval, along with the
+    files closest to expiring while the directory holds more than maxBytes.
+    
+    Attributes:
+        directory (string): path of the directory holding the files
+        maxAge (float): lifetime (s) of files stored without an expiry
+        maxBytes (int): size limit of the files in the directory
+        pruneInterval (float): minimum time (s) between prunes
+    
+    """
+    
+    def __init__(self, directory, maxAge = 24*3600, maxBytes = 2**30,
+                 pruneInterval = 60):
+        self.directory = directory
+        self.maxAge = maxAge
+        self.maxBytes = maxBytes
+        self.pruneInterval = pruneInterval
+        self.lastPrune = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    
+    def get(self, key):
+        """Returns the bytes stored with the key, or None if not found or
+        expired."""
+        if not is_valid_key(key):
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            if os.path.getmtime(path) < time.time():
+                return None
+            with open(path, 'rb') as infile:
+                return infile.read()
+        except (OSError, ValueError):
+            return None
+    
+    def set(self, key, value, ex = None):
+        """Stores bytes with the given key, expiring after ex seconds (or
+        maxAge, if ex isn't given)."""
+        if not is_valid_key(key):
+            raise ValueError('invalid session store key: {!r}'.format(key))
+        if ex is None:
+            ex = self.maxAge
+        path = os.path.join(self.directory, key)
+        tmpPath = path + '.' + uuid4().hex + '.tmp'
+        with open(tmpPath, 'wb') as outfile:
+            outfile.write(value)
+        now = time.time()
+        os.utime(tmpPath, (now, now + ex))
+        os.replace(tmpPath, path)
+        
+        if now - self.lastPrune > self.pruneInterval:
+            self.lastPrune = now
+            self.prune()
+    
+    def delete(self, key):
+        """Removes the bytes stored with the key, if there are any."""
+        if not is_valid_key(key):
+            return
+        try:
+            os.remove(os.path.join(self.directory, key))
+        except OSError:
+            pass
+    
+    def prune(self):
+        """Removes expired files, then the files closest to expiring until
+        the directory's files take up at most maxBytes."""
+        
+        now = time.time()
+        files = []
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            try:
+                expiry = os.path.getmtime(path)
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            # temporary files have not been given an expiry yet, so they are
+            # only removed if they were left behind by a failed write
+            if filename.endswith('.tmp'):
+                expiry = expiry + self.maxAge
+            if expiry < now:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            else:
+                files.append((expiry, size, path))
+        
+        files.sort()
+        totalBytes = sum(size for expiry, size, path in files)
+        for expiry, size, path in files:
+            if totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+                totalBytes = totalBytes - size
+            except OSError:
+                pass
+
+class SessionStore:
+    """Keyed store of Python objects with least-recently-used eviction.
+    
+    The client only holds the keys, so large objects (systems, orbits,
+    crafts) don't need to be serialized and sent with every callback. If a
+    backend is given, objects are also written to it, so that they outlive
+    eviction and can be shared between worker processes. Keys may only
+    contain letters, digits, underscores, and hyphens (see KEY_PATTERN).
+    
+    Attributes:
+        maxSize (int): number of objects kept in memory
+        backend: optional object with get(key), set(key, bytes), and
+            delete(key) methods, such as a FileBackend or a Redis client
+        entries (OrderedDict): objects in memory, least recently used first
+        pinned (dict): objects that are never evicted
+    
+    """
+    
+    def __init__(self, maxSize = 256, backend = None, ttl = 24*3600):
+        self.maxSize = maxSize
+        self.backend = backend
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.pinned = dict()
+        self.lock = threading.Lock()
+    
+    def pin(self, key, obj):
+        """Stores an object under a fixed key that is never evicted."""
+        with self.lock:
+            self.pinned[key] = obj
+        return key
+    
+    def put(self, obj, key = None, cache = True, share = True, ttl = None):
+        """Stores an object and returns the key used to retrieve it.
+        
+        Args:
+            obj: the object to be stored
+            key (string): if provided, the key to store the object under.
+                Otherwise, a new random key is generated.
+            cache (bool): if false and there is a backend, the object is
+                only written to the backend, and not kept in memory
+            share (bool): if false, the object is only kept in memory, and
+                not written to the backend
+            ttl (int): lifetime (s) of the object in the backend, if it
+                differs from the store's ttl
+        
+        Returns:
+            the key of the stored object
+        
+        Raises:
+            ValueError: if the key doesn't match KEY_PATTERN
+        """
+        
+        if key is None:
+            key = uuid4().hex
+        if not is_valid_key(key):
+            raise ValueError('invalid session store key: {!r}'.format(key))
+        
+        if ttl is None:
+            ttl = self.ttl
+        if not (self.backend is None) and share:
+            self.backend.set(key, pickle.dumps(obj), ex = ttl)
+            if not cache:
+                return key
+        
+        with self.lock:
+            self.entries[key] = obj
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        
+        return key
+    
+    def get(self, key):
+        """Returns the object stored with the key.
+        
+        Raises:
+            KeyError: if no object is stored with the key, the key isn't
+                valid, or the stored object can't be read
+        """
+        
+        if not is_valid_key(key):
+            raise KeyError(key)
+        
+        with self.lock:
+            if key in self.pinned:
+                return self.pinned[key]
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        
+        if not self.backend is None:
+            value = self.backend.get(key)
+            if not value is None:
+                try:
+                    obj = pickle.loads(value)
+                except Exception:
+                    raise KeyError(key)
+                with self.lock:
+                    self.entries[key] = obj
+                    while len(self.entries) > self.maxSize:
+                        self.entries.popitem(last=False)
+                return obj
+        
+        raise KeyError(key)
+    
+    def delete(self, key):
+        """Removes the object stored with the key, if there is one."""
+        
+        with self.lock:
+            self.entries.pop(key, None)
+        if not (self.backend is None) and is_valid_key(key):
+            self.backend.delete(key)
+    
+    def __contains__(self, key):
+        try:
+            self.get(key)
+            return True
+        except KeyError:
+            return False
@@ -24,6 +24,9 @@ class Transfer:
                 orbit given position
         endPos (vector): : if provided, fixes target location of the transfer
                 orbit at the given position
+        startState (tuple): if provided, the position and velocity vectors 
+                of the departure orbit at the start time, so that they need
+                not be recalculated for transfers sharing a start time
         transferOrbit (Orbit): orbital trajectory between start and end.
             If there is a plane change maneuver, this is the portion of the
             trajectory prior to the maneuver.
@@ -48,10 +51,13 @@ class Transfer:
             
     """
     
+    # Running total of Lambert solver iterations, used for benchmarking
+    lambertIterations = 0
+    
     def __init__(self, startOrbit, endOrbit, startTime, flightTime, 
                  planeChange = False, ignoreInsertion = False,
                  cheapStartOrb = False, cheapEndOrb = True,
-                 startPos = None, endPos = None):
+                 startPos = None, endPos = None, startState = None):
         
         # Assign input attributes
         self.startOrbit = startOrbit
@@ -64,6 +70,12 @@ class Transfer:
         self.cheapEndOrb = cheapEndOrb
         self.startPos = startPos
         self.endPos = endPos
+        self.startState = startState
+        self.startStateTime = startTime
+        
+        # A precomputed departure state fixes the start of the transfer orbit
+        if (self.startPos is None) and not (startState is None):
+            self.startPos = startState[0]
         
         self.originalStartOrbit = copy(self.startOrbit)
         self.originalEndOrbit = copy(self.endOrbit)
@@ -89,6 +101,42 @@ class Transfer:
         # self.genetic_refine()
     
     
+    @staticmethod
+    def get_departure_orbit(startOrbit, endOrbit):
+        """Returns the orbit in which the transfer trajectory begins.
+        
+        Args:
+            startOrbit (Orbit): orbit prior to departure
+            endOrbit (Orbit): orbit following arrival
+        
+        Returns:
+            the starting orbit, or the orbit of its primary body if an 
+            ejection from the primary's sphere of influence is needed
+        """
+        
+        if (startOrbit.prim == endOrbit.prim) or                            \
+            (not startOrbit.prim in endOrbit.prim.satellites and            \
+             endOrbit.prim in startOrbit.prim.satellites):
+            return startOrbit
+        else:
+            return startOrbit.prim.orb
+    
+    
+    def get_departure_state(self):
+        """Returns the departure orbit's state vector at the start time.
+        
+        Returns:
+            The position (m) and velocity (m/s) vectors in a list
+        """
+        
+        if not (self.startState is None) and                                \
+            self.startTime == self.startStateTime:
+            return self.startState
+        
+        return self.get_departure_orbit(self.startOrbit, self.endOrbit)     \
+            .get_state_vector(self.startTime)
+    
+    
     @staticmethod
     def solve_lambert(startOrbit, endOrbit, startTime, flightTime,
                       planeChange = False, startPos = None, endPos = None,
@@ -221,6 +269,8 @@ class Transfer:
             elif pNext > pMax:
                 pNext = (p + pMax)/2
         
+        Transfer.lambertIterations = Transfer.lambertIterations + it
+        
         # From final p-iteration parameters, calculate velocity at the start
         # of the transfer orbit, and then define the transfer orbit
         vStart = (rEnd - f * rStart)/g
@@ -322,7 +372,7 @@ class Transfer:
                                        self.startPos, self.endPos);
             
             # Get departure burn delta v
-            vStart = self.startOrbit.get_state_vector(self.startTime)[1]
+            vStart = self.get_departure_state()[1]
             vTrStart = self.transferOrbit.get_state_vector(self.startTime)[1]
             self.ejectionDV = vTrStart - vStart
             
@@ -406,7 +456,7 @@ class Transfer:
             self.get_insertion_details()
             
             # Get departure burn delta v
-            vStart = self.startOrbit.get_state_vector(self.startTime)[1]
+            vStart = self.get_departure_state()[1]
             vTrStart = self.transferOrbit.get_state_vector(self.startTime)[1]
             self.ejectionDV = vTrStart - vStart
             
@@ -472,7 +522,7 @@ class Transfer:
         rEscape = self.startOrbit.prim.soi  # distance from body at escape
         
         # Get velocity of primary body and velocity needed after escape
-        vPrim = self.startOrbit.prim.orb.get_state_vector(self.startTime)[1]
+        vPrim = self.get_departure_state()[1]
         vTrans = self.transferOrbit.get_state_vector(self.startTime)[1]
 
         err = tol + 1